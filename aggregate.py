@@ -0,0 +1,184 @@
+from itertools import chain
+
+from indexes import Bitmap, OrderedIndex
+
+try:
+    import numpy as np  # необязательно: векторный подсчёт для полей с большим числом значений
+except ImportError:
+    np = None
+
+AGGREGATES = ("count", "sum", "avg", "min", "max")
+
+# Группы и значения берутся из индексов (ключ -> адреса записей), файл данных не читается.
+# Значение поля кодируется рангом ключа в порядке поля, поэтому min/max возвращают ключ
+# (дату, индекс соответствия), а sum/avg считаются по числам, соответствующим рангам.
+
+
+def value_keys(index) -> list: # непустые ключи индекса в порядке поля
+    keys = index.ordered() if isinstance(index, OrderedIndex) else sorted(index)
+    return [key for key in keys if len(index[key])]
+
+
+def numbers_of(field: str, keys: list) -> list:
+    try:
+        return [float(key) for key in keys]
+    except ValueError:
+        raise ValueError(f"Поле {field} не числовое: sum и avg для него не считаются.")
+
+
+def count_within(offsets, within: set) -> int: # размер пересечения списка адресов с множеством
+    if isinstance(offsets, Bitmap) and len(within) < len(offsets):
+        return sum(1 for offset in within if offset in offsets)
+    return len(within.intersection(offsets))
+
+
+def counts(groups: dict, within: set = None) -> dict: # только число записей в группах
+    result = {}
+    for key, offsets in groups.items():
+        count = len(offsets) if within is None else count_within(offsets, within)
+        if count:
+            result[key] = count
+    return result
+
+
+def accumulate(groups, values: dict, keys: list, numbers: list = None, within: set = None) -> dict:
+    # groups: ключ группы -> адреса (None - одна группа из всех записей), values: индекс поля значения,
+    # keys: value_keys(values), numbers: числа для sum/avg (None - не нужны)
+    # -> {группа: [count, sum, ранг min, ранг max]}
+    if np is not None:
+        return _by_numpy(groups, values, keys, numbers, within)
+    if within is None and all(isinstance(values[key], Bitmap) for key in keys) and (
+            groups is None or all(isinstance(offsets, Bitmap) for offsets in groups.values())):
+        return _by_bitmaps(groups, values, keys, numbers)
+    return _by_column(groups, values, keys, numbers, within)
+
+
+def _add(stats: dict, group, rank: int, count: int, number: float):
+    row = stats.get(group)
+    if row is None:
+        stats[group] = [count, number * count, rank, rank]
+        return
+    row[0] += count
+    row[1] += number * count
+    if rank < row[2]:
+        row[2] = rank
+    if rank > row[3]:
+        row[3] = rank
+
+
+def _by_bitmaps(groups, values, keys, numbers) -> dict: # мало значений: пересечения битовых карт
+    stats = {}
+    for rank, key in enumerate(keys):
+        number = numbers[rank] if numbers is not None else 0.0
+        if groups is None:
+            _add(stats, None, rank, len(values[key]), number)
+            continue
+        for group, offsets in groups.items():
+            count = offsets.and_count(values[key])
+            if count:
+                _add(stats, group, rank, count, number)
+    return stats
+
+
+def _by_column(groups, values, keys, numbers, within) -> dict: # адрес -> ранг значения, проход по группам
+    column = {}
+    for rank, key in enumerate(keys):
+        for offset in values[key]:
+            column[offset] = rank
+    items = {None: column} if groups is None else groups
+    stats = {}
+    for group, offsets in items.items():
+        count = 0
+        total = 0.0
+        lo = hi = None
+        for offset in offsets:
+            if within is not None and offset not in within:
+                continue
+            rank = column.get(offset)
+            if rank is None:
+                continue
+            count += 1
+            if numbers is not None:
+                total += numbers[rank]
+            if lo is None or rank < lo:
+                lo = rank
+            if hi is None or rank > hi:
+                hi = rank
+        if count:
+            stats[group] = [count, total, lo, hi]
+    return stats
+
+
+def _bitmap_array(bitmap: Bitmap): # адреса битовой карты без поэлементного перебора
+    parts = [np.empty(0, dtype=np.int64)]
+    for high, chunk in bitmap.containers():
+        if isinstance(chunk, bytearray):
+            lows = np.flatnonzero(np.unpackbits(np.frombuffer(chunk, dtype=np.uint8), bitorder="little"))
+        else:
+            lows = np.frombuffer(chunk, dtype=np.uint16)
+        parts.append(lows.astype(np.int64) + (high << 16))
+    return np.concatenate(parts)
+
+
+def _flatten(index: dict, keys: list): # все адреса индекса и номер ключа для каждого
+    lengths = [len(index[key]) for key in keys]
+    if keys and isinstance(index[keys[0]], Bitmap):
+        offsets = np.concatenate([_bitmap_array(index[key]) for key in keys])
+    else:
+        offsets = np.fromiter(chain.from_iterable(index[key] for key in keys), dtype=np.int64, count=sum(lengths))
+    codes = np.repeat(np.arange(len(keys)), lengths)
+    return offsets, codes
+
+
+def _by_numpy(groups, values, keys, numbers, within) -> dict: # то же через сортировку и bincount
+    value_offsets, ranks = _flatten(values, keys)
+    order = np.argsort(value_offsets)
+    value_offsets = value_offsets[order]
+    ranks = ranks[order]
+
+    if groups is None:
+        group_keys = [None]
+        offsets = value_offsets
+        codes = np.zeros(len(offsets), dtype=np.int64)
+    else:
+        group_keys = [key for key in groups if len(groups[key])]
+        offsets, codes = _flatten(groups, group_keys)
+
+    # ранг значения для каждого адреса группы (адреса без значения отбрасываются)
+    positions = np.searchsorted(value_offsets, offsets)
+    positions[positions == len(value_offsets)] = 0
+    found = value_offsets[positions] == offsets if len(value_offsets) else np.zeros(len(offsets), dtype=bool)
+    if within is not None:
+        found &= np.isin(offsets, np.fromiter(within, dtype=np.int64, count=len(within)))
+    codes = codes[found]
+    record_ranks = ranks[positions[found]]
+
+    size = len(group_keys)
+    count = np.bincount(codes, minlength=size)
+    total = np.bincount(codes, weights=np.asarray(numbers)[record_ranks], minlength=size) \
+        if numbers is not None else np.zeros(size)
+    lo = np.full(size, len(keys))
+    hi = np.full(size, -1)
+    np.minimum.at(lo, codes, record_ranks)
+    np.maximum.at(hi, codes, record_ranks)
+    return {group_keys[i]: [int(count[i]), float(total[i]), int(lo[i]), int(hi[i])]
+            for i in np.flatnonzero(count)}
+
+
+def rows(stats: dict, keys: list, funcs) -> dict: # [count, sum, min, max] -> {функция: результат}
+    result = {}
+    for group, (count, total, lo, hi) in stats.items():
+        row = {}
+        for func in funcs:
+            if func == "count":
+                row[func] = count
+            elif func == "sum":
+                row[func] = total
+            elif func == "avg":
+                row[func] = total / count
+            elif func == "min":
+                row[func] = keys[lo]
+            elif func == "max":
+                row[func] = keys[hi]
+        result[group] = row
+    return result
@@ -0,0 +1,196 @@
+import hashlib
+import json
+import os
+import shutil
+import time
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+BACKUP_DIR = "backups"  # директория копий рядом с файлом данных
+MANIFEST = "manifest.json"
+BLOCK_BYTES = 64 << 10  # файлы сравниваются с базовой копией блоками такого размера
+FICLONE = 0x40049409  # ioctl Linux: копия файла без копирования данных (btrfs, xfs)
+
+# Копия N - директория backups/NNNN с manifest.json. Базовая (полная) копия хранит каждый файл
+# базы целиком, разностная - только блоки, изменившиеся с последней базовой: в файле данных это
+# изменённые и дописанные записи, у журнала - дописанный хвост, а неизменённые индексы не
+# хранятся вовсе. Полная копия файла делается через reflink, где его умеет файловая система,
+# неизменённые с прошлой базовой копии файлы - жёсткими ссылками.
+# Восстановление - базовая копия плюс блоки одной разностной. Индексы возвращаются вместе
+# с двоичным снимком и с прежним временем изменения CSV-файлов, так что снимок остаётся
+# действительным и база открывается без разбора CSV-индексов.
+
+
+def backup_dir(db) -> str:
+    return os.path.join(os.path.dirname(os.path.abspath(db.file_path)), BACKUP_DIR)
+
+
+def list_backups(directory: str) -> list: # манифесты копий по возрастанию номера
+    if not os.path.isdir(directory):
+        return []
+    manifests = []
+    for name in sorted(os.listdir(directory)):
+        path = os.path.join(directory, name, MANIFEST)
+        if name.isdigit() and os.path.exists(path):
+            with open(path, "r") as file:
+                manifests.append(json.load(file))
+    return manifests
+
+
+def _stat(path: str) -> list:
+    info = os.stat(path)
+    return [info.st_size, info.st_mtime_ns, info.st_ino]
+
+
+def _digests(path: str) -> list: # отпечатки блоков файла
+    digests = []
+    with open(path, "rb") as file:
+        while True:
+            block = file.read(BLOCK_BYTES)
+            if not block:
+                break
+            digests.append(hashlib.blake2b(block, digest_size=16).hexdigest())
+    return digests
+
+
+def _clone(src: str, dst: str): # копия файла: reflink, если файловая система умеет, иначе обычная
+    if fcntl is not None:
+        try:
+            with open(src, "rb") as source, open(dst, "wb") as target:
+                fcntl.ioctl(target.fileno(), FICLONE, source.fileno())
+            return
+        except OSError:
+            pass
+    shutil.copyfile(src, dst)
+
+
+def _link(src: str, dst: str): # неизменяемый файл прошлой копии - жёсткой ссылкой, без второго места на диске
+    try:
+        os.link(src, dst)
+    except OSError:
+        _clone(src, dst)
+
+
+def backup(db, directory: str = None, full: bool = False) -> dict: # новая копия, возвращает её манифест
+    # разностная, если есть базовая копия и full не задан; чтения базы во время копирования идут,
+    # изменения ждут конца копирования
+    directory = directory or backup_dir(db)
+    manifests = list_backups(directory)
+    bases = [manifest for manifest in manifests if manifest["base"] == manifest["number"]]
+    base = None if full or not bases else bases[-1]
+    number = manifests[-1]["number"] + 1 if manifests else 1
+    target_dir = os.path.join(directory, f"{number:04d}")
+    tmp_dir = target_dir + ".tmp"  # недоделанная копия не видна в списке
+    if os.path.exists(tmp_dir):
+        shutil.rmtree(tmp_dir)
+    os.makedirs(tmp_dir)
+
+    db.ensure_snapshot()
+    manifest = {"number": number, "base": number if base is None else base["number"],
+                "created": time.time(), "storage": db.storage.kind, "files": {}}
+    stored = 0
+    with db.lock.read():
+        db.storage.flush()
+        for role, path in db.files().items():
+            if not os.path.exists(path):
+                continue
+            if base is None:
+                entry = _store_full(path, role, tmp_dir, bases[-1] if bases else None, directory)
+            else:
+                entry = _store_changes(path, role, tmp_dir, base)
+            stored += entry.pop("stored")
+            manifest["files"][role] = entry
+    manifest["stored_bytes"] = stored
+    with open(os.path.join(tmp_dir, MANIFEST), "w") as file:
+        json.dump(manifest, file)
+    os.replace(tmp_dir, target_dir)
+    return manifest
+
+
+def _blocks_path(directory: str, role: str) -> str:
+    return os.path.join(directory, role.replace(" ", "_") + ".blocks")
+
+
+def _store_full(path: str, role: str, target_dir: str, previous, directory: str) -> dict:
+    stat = _stat(path)
+    old = previous["files"].get(role) if previous is not None else None
+    if old is not None and role != "Data" and old["stat"] == stat:
+        # файл не менялся с прошлой базовой копии - та же копия по жёсткой ссылкой
+        _link(_blocks_path(os.path.join(directory, f"{previous['number']:04d}"), role), _blocks_path(target_dir, role))
+        return {"stat": stat, "digests": old["digests"], "blocks": None, "stored": 0}
+    _clone(path, _blocks_path(target_dir, role))
+    return {"stat": stat, "digests": _digests(path), "blocks": None, "stored": stat[0]}  # None - файл целиком
+
+
+def _store_changes(path: str, role: str, target_dir: str, base: dict) -> dict:
+    stat = _stat(path)
+    old = base["files"].get(role)
+    # у файла данных время изменения ненадёжно (запись через mmap) - он сравнивается всегда
+    if old is not None and role != "Data" and old["stat"] == stat:
+        return {"stat": stat, "blocks": [], "stored": 0}
+    base_digests = old["digests"] if old is not None else []
+    blocks = []
+    written = 0
+    with open(path, "rb") as source, open(_blocks_path(target_dir, role), "wb") as target:
+        number = 0
+        while True:
+            block = source.read(BLOCK_BYTES)
+            if not block:
+                break
+            if (number >= len(base_digests)
+                    or hashlib.blake2b(block, digest_size=16).hexdigest() != base_digests[number]):
+                target.write(block)
+                blocks.append(number)
+                written += len(block)
+            number += 1
+    return {"stat": stat, "blocks": blocks, "stored": written}
+
+
+def restore(db, number: int = None, directory: str = None) -> dict: # база возвращается к копии (по умолчанию последней)
+    directory = directory or backup_dir(db)
+    manifests = {manifest["number"]: manifest for manifest in list_backups(directory)}
+    if not manifests:
+        raise ValueError("Резервных копий нет.")
+    number = max(manifests) if number is None else number
+    if number not in manifests:
+        raise ValueError(f"Резервной копии {number} нет.")
+    manifest = manifests[number]
+    base = manifests[manifest["base"]]
+    base_dir = os.path.join(directory, f"{base['number']:04d}")
+    own_dir = os.path.join(directory, f"{manifest['number']:04d}")
+
+    with db.lock.write():
+        files = db.files()
+        db.close()
+        # сначала все файлы собираются рядом, потом подменяются разом
+        for role, entry in manifest["files"].items():
+            _rebuild(files[role] + ".restore", role, entry, base, base_dir, own_dir)
+        for role, path in files.items():
+            if role in manifest["files"]:
+                os.replace(path + ".restore", path)
+            elif os.path.exists(path):
+                os.remove(path)  # файла в копии не было (например, журнала) - чужой не должен остаться
+        db.reopen(files["Data"], db.index_files, manifest["storage"])
+    return manifest
+
+
+def _rebuild(path: str, role: str, entry: dict, base: dict, base_dir: str, own_dir: str):
+    base_entry = base["files"].get(role)
+    if entry["blocks"] is None:
+        _clone(_blocks_path(own_dir, role), path)
+    elif base_entry is not None:
+        _clone(_blocks_path(base_dir, role), path)
+    else:
+        open(path, "wb").close()
+    if entry["blocks"]:
+        with open(_blocks_path(own_dir, role), "rb") as source, open(path, "r+b") as target:
+            for number in entry["blocks"]:
+                target.seek(number * BLOCK_BYTES)
+                target.write(source.read(BLOCK_BYTES))
+    size, mtime_ns, _ = entry["stat"]
+    os.truncate(path, size)
+    # прежнее время изменения: по нему двоичный снимок проверяет, что CSV-индексы те же
+    os.utime(path, ns=(mtime_ns, mtime_ns))
@@ -1,39 +1,299 @@
 import csv
 import os
-from typing import List, Dict, Any
+from contextlib import contextmanager
+from typing import List, Dict
 import random
 import string
+import threading
 import time
 
+from aggregate import AGGREGATES, accumulate, counts, numbers_of, rows, value_keys
+from indexes import (BITMAP_MAGIC, Bitmap, OrderedIndex, Postings, TextIndex, date_key, load_bitmap_index,
+                     number_key, save_bitmap_index)
+from journal import Journal
+from metrics import Metrics, instrumented
+from querycache import QueryCache
+from rwlock import RWLock, reading, writing
+from scan import field_range, filter_range, index_range, live_range, merge_indices, merge_postings, scan, scan_iter
+from snapshot import Snapshot, save_snapshot
+from storage import FIELDS, REMOVED_SN, RecordCache, open_storage, convert as convert_storage
+
+CHECKPOINT_MIN = 10000  # журнал не сворачивается в снимок, пока в нём меньше записей
+BITMAP_FIELDS = ("Compliance Index", "Sold")  # поля с малым числом значений - списки адресов как битовые карты
+# тип списка адресов для каждого поля: у SN адрес всегда один, у Name и Date - сжатые массивы
+POSTINGS = {"SN": list, "Name": Postings, "Date": Postings, "Compliance Index": Bitmap, "Sold": Bitmap}
+INDEX_ATTRS = {"SN": "indicesSN", "Name": "indicesNAME", "Date": "indicesDATE",
+               "Compliance Index": "indicesIND", "Sold": "indicesSOLD"}
+ORDERED = {"Date": date_key, "Compliance Index": number_key}  # поля с поиском по диапазону
+TEXT_FIELDS = ("Name",)  # поля с поиском по началу и по подстроке (TextIndex)
+DELTA_MAX = 10000  # изменений в буфере незагруженного индекса, после - индекс загружается
+CACHE_BYTES = 8 << 20  # память под кэш прочитанных записей по умолчанию (0 - без кэша)
+QUERY_CACHE_BUDGET = 1000000  # адресов в кэше ответов на запросы
+COMPACT_RATIO = 0.3  # доля удалённых записей, с которой сжатие запускается в фоне само (None - никогда)
+COMPACT_MIN_REMOVED = 10000  # пока удалённых меньше, сжатие само не запускается
+SEGMENT_BYTES = 256 << 10  # часть файла, переносимая за одно взятие блокировки чтения
+# имена файлов индексов в директории базы; битовые карты (BITMAP_FIELDS) - двоичный формат .bm
+INDEX_FILES = {"SN": "index_sn.csv", "Name": "index_name.csv", "Date": "index_date.csv",
+               "Compliance Index": "index_compliance_index.bm", "Sold": "index_sold.bm", "Removed": "removed.txt"}
+
+
+BITMAP_EXTENSION = ".bm"
+LEGACY_EXTENSION = ".csv"  # так файлы битовых карт назывались раньше; читаются, пока их не сменит снимок
+
+
+def _legacy_path(file_path: str): # прежнее имя файла индекса-битовых карт, None - у файла его нет
+    stem, extension = os.path.splitext(file_path)
+    return stem + LEGACY_EXTENSION if extension == BITMAP_EXTENSION else None
+
+
+def default_index_paths(directory: str) -> dict: # файлы индексов базы, лежащие в directory
+    return {field: os.path.join(directory, name) for field, name in INDEX_FILES.items()}
+
+
+def service_files(index_paths: dict) -> list: # служебные файлы рядом с индексами (журнал, двоичный снимок)
+    if index_paths.get("Removed") is None:
+        return []
+    directory = os.path.dirname(index_paths["Removed"])
+    journal_path = index_paths.get("Journal") or os.path.join(directory, "journal.log")
+    return [journal_path, journal_path + ".ckpt", os.path.join(directory, "indices.snap")]
+
+
+def _lazy_index(field: str): # свойство-индекс поля: загрузка при первом обращении
+    attr = "_" + INDEX_ATTRS[field]
+
+    def get(self):
+        if field in self._unloaded:
+            with self._load_lock:  # два читателя не должны загружать один индекс одновременно
+                if field in self._unloaded:
+                    self._materialize(field)
+        return getattr(self, attr)
+
+    def set(self, index):
+        self._unloaded.discard(field)
+        self._pending.pop(field, None)
+        self._generations[field] += 1
+        setattr(self, attr, self._wrap(field, index))
+
+    return property(get, set)
+
+
+def _add_posting(index, field: str, key: str, offset: int):
+    postings = index.get(key)
+    if postings is None:
+        index[key] = POSTINGS[field]([offset])
+    else:
+        postings.append(offset)
+
+
+def _remove_posting(index, key: str, offset: int):
+    postings = index[key]
+    postings.remove(offset)
+    if not postings:
+        del index[key]
+
+
+class Compaction: # фоновое сжатие: живые записи по частям переносятся в новый файл, затем файлы подменяются
+    # Части файла копируются под блокировкой чтения (поиск и изменения идут между частями),
+    # индексы нового файла строятся тут же по перенесённым записям. Всё, что изменили
+    # на месте за это время (storage.changed), и записи, дописанные в конец, доносятся
+    # под блокировкой записи в самом конце - вместе с подменой файла и индексов.
+    def __init__(self, db, segment_bytes: int = SEGMENT_BYTES):
+        self.db = db
+        self.segment_bytes = segment_bytes
+        self.progress = 0.0
+        self.error = None  # исключение, если сжатие не удалось
+        self.swapped = False  # файл подменён - сжатие завершено
+        self._cancelled = False
+        self._storage = None
+        self._target = None
+        self._thread = threading.Thread(target=self._run, name="compaction", daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def done(self) -> bool:
+        return self._thread.ident is not None and not self._thread.is_alive()
+
+    def wait(self, timeout: float = None):
+        self._thread.join(timeout)
+
+    def cancel(self): # новый файл удаляется, старый остаётся как был
+        with self.db.lock.write():  # поток сжатия сейчас не трогает ни один из файлов
+            self._cancelled = True
+            if self._storage is not None:
+                self._storage.changed = None
+            if self._target is not None:
+                self._target.close()
+                if os.path.exists(self._target.file_path):
+                    os.remove(self._target.file_path)
+                self._target = None
+
+    def _run(self):
+        try:
+            self._compact()
+        except Exception as e:
+            self.error = e
+            self.cancel()
+
+    def _compact(self):
+        db = self.db
+        with db.lock.read():
+            if self._cancelled:
+                return
+            storage = self._storage = db.storage
+            storage.changed = set()
+            storage.flush()
+            segments = storage.ranges(os.path.getsize(storage.file_path) // self.segment_bytes + 1)
+            self._target = target = storage._scratch(".compact")
+        tail = segments[-1][1] if segments else 0  # дальше - записи, дописанные во время сжатия
+        mapping = {}  # старый адрес живой записи -> новый
+        indices = {field: {} for field in FIELDS}
+
+        for number, (start, stop) in enumerate(segments, 1):
+            with db.lock.read():
+                if self._cancelled:
+                    return
+                rows = list(storage.records(start, stop, skip_removed=True))
+                self._copy(rows, mapping, indices)
+            self.progress = number / (len(segments) + 1)
+
+        # списки адресов приводятся к типам индексов без блокировки: это самая долгая часть
+        indices = {field: db._wrap(field, index) for field, index in indices.items()}
+
+        with db.lock.write():
+            if self._cancelled:
+                return
+            removed = self._catch_up(mapping, indices, tail)
+            storage.changed = None
+            self._target = None
+            storage._swap(target)
+            db._replace_indices(indices, removed)
+            db.checkpoint()  # адреса в журнале относятся к старому файлу - снимок с нуля
+            self.swapped = True
+            self.progress = 1.0
+
+    def _copy(self, rows, mapping: dict, indices: dict): # [(старый адрес, поля)] -> в конец нового файла
+        offsets = self._target.append_many([fields for _, fields in rows])
+        for (old, fields), offset in zip(rows, offsets):
+            mapping[old] = offset
+            for field, key in zip(FIELDS, fields):
+                _add_posting(indices[field], field, key, offset)
+
+    def _catch_up(self, mapping: dict, indices: dict, tail: int) -> list: # изменения за время переноса
+        storage, target = self._storage, self._target
+        removed = []  # удалённые после переноса - новые пустые слоты
+        for old in sorted(storage.changed):
+            if old >= tail:
+                continue  # хвост переносится ниже целиком
+            fields = storage.read(old)
+            live = fields is not None and fields[0] != REMOVED_SN
+            offset = mapping.get(old)
+            if offset is None:
+                if live:  # удалённый при переносе слот снова занят
+                    self._copy([(old, fields)], mapping, indices)
+                continue
+            copied = target.read(offset)
+            if live and fields == copied:
+                continue
+            for field, key in zip(FIELDS, copied):
+                _remove_posting(indices[field], key, offset)
+            if live:
+                target.write(offset, fields)  # в csv строка слота всегда одной длины
+                for field, key in zip(FIELDS, fields):
+                    _add_posting(indices[field], field, key, offset)
+            else:
+                target.erase(offset)
+                removed.append(offset)
+                del mapping[old]
+        self._copy(list(storage.records(tail, skip_removed=True)), mapping, indices)
+        target.flush()
+        return removed
+
+
 class mydb:
-    def __init__(self, file_path: str, index_paths: dict):
+    def __init__(self, file_path: str, index_paths: dict, storage: str = None, cache_bytes: int = CACHE_BYTES,
+                 query_cache: str = "records"):
+        self.storage = None
+        # чтения (search, query, ...) идут параллельно, изменения - по одному и без читателей;
+        # для нескольких операций как одной: with db.lock.read() / with db.lock.write()
+        self.lock = RWLock()
+        self._load_lock = threading.RLock()  # ленивая загрузка индексов происходит и при чтении
+        self._batch_depth = 0  # > 0 - внутри batch(), журнал фиксируется при выходе
+        self.metrics = Metrics()  # счётчики и задержки операций, по умолчанию выключены
+        self.cache_bytes = cache_bytes
+        # кэш ответов search/query: "records" - готовые записи, "offsets" - только адреса, None - выключен
+        self.query_cache = None if query_cache is None else QueryCache(query_cache, QUERY_CACHE_BUDGET)
+        self.compact_ratio = COMPACT_RATIO
+        self._compaction = None  # идущее фоновое сжатие (Compaction)
+        self._streams = 0  # идущие проходы по файлу без блокировки (выгрузка): файл не подменяется
+        self.reopen(file_path, index_paths, storage)
+
+    @writing
+    def reopen(self, file_path: str, index_paths: dict, storage: str = None): # открытие БД (формат "csv" или "bin", по умолчанию определяется по файлу)
+        self.close()
 
         self.file_path = file_path
 
         self.index_files = index_paths
 
-        self.indicesSN = {}  # хэш-таблицы для индексации (по полям)
-        self.indicesNAME = {}
-        self.indicesDATE = {}
-        self.indicesIND = {}
-        self.indicesSOLD = {}
+        # хэш-таблицы для индексации (по полям) загружаются при первом обращении,
+        # до этого изменения копятся в буфере _pending
+        self._unloaded = set(FIELDS)
+        self._pending = {}
+        self._snapshot = None
+
+        # поколения записи по полям: растут при каждом изменении индекса поля
+        self._generations = dict.fromkeys(FIELDS, 0)
+        if self.query_cache is not None:
+            self.query_cache.clear()
 
         self.removed_path = index_paths["Removed"]
 
-        self.indicesSN = self.load_index(self.index_files["SN"])
-        self.indicesNAME = self.load_index(self.index_files["Name"])
-        self.indicesDATE = self.load_index(self.index_files["Date"])
-        self.indicesIND = self.load_index(self.index_files["Compliance Index"])
-        self.indicesSOLD = self.load_index(self.index_files["Sold"])
+        # журнал изменений: индексы = последний снимок (файлы индексов) + хвост журнала
+        self.journal = None
+        if self.removed_path is not None:
+            self.journal = Journal(service_files(index_paths)[0])
+            self.journal.recover(self._snapshot_paths() + [self._binary_snapshot_path()])
 
-        self.removed = self.load_removed(self.removed_path)
+        # быстрый путь - двоичный снимок, если он не устарел, иначе разбор CSV
+        self._snapshot = self._open_binary_snapshot()
+        self.removed = self._snapshot.load_removed() if self._snapshot is not None else None
+        if self.removed is None:
+            self.removed = self.load_removed(self.removed_path)
 
+        if self.journal is not None:
+            for op, field, key, offset in self.journal.replay():
+                self._apply(op, field, key, offset)
 
+        self.storage = None
         if self.file_path is not None:
-            if not os.path.exists(self.file_path):
-                with open(self.file_path, "w", newline="") as file:
-                    writer = csv.writer(file)
-                    writer.writerow(["SN", "Name", "Date", "Compliance Index", "Sold"])
+            self.storage = open_storage(self.file_path, storage)
+            self._attach(self.storage)
+
+    def _attach(self, storage): # общие счётчики и новый кэш записей для файла данных
+        storage.metrics = self.metrics
+        storage.cache = RecordCache(self.cache_bytes) if self.cache_bytes else None
+
+    indicesSN = _lazy_index("SN")
+    indicesNAME = _lazy_index("Name")
+    indicesDATE = _lazy_index("Date")
+    indicesIND = _lazy_index("Compliance Index")
+    indicesSOLD = _lazy_index("Sold")
+
+    def _wrap(self, field: str, index): # списки адресов приводятся к типу поля, Date и Compliance Index упорядочены
+        if index is None:
+            return None
+        index = self._as_postings(index, POSTINGS[field])
+        if field in TEXT_FIELDS:
+            index = TextIndex(index)
+        elif field in ORDERED:
+            index = OrderedIndex(ORDERED[field], index)
+        return index
+
+    @staticmethod
+    def _as_postings(index: dict, kind) -> dict:
+        return {key: offsets if isinstance(offsets, kind) else kind(offsets) for key, offsets in index.items()}
 
     @classmethod
     def create_empty(cls):
@@ -57,6 +317,106 @@ class mydb:
         instance.removed = None
         return instance
 
+    @writing
+    def close(self): # закрытие файла данных и журнала (нужно перед копированием/удалением)
+        self._stop_compaction()
+        if getattr(self, "journal", None) is not None:
+            self.journal.commit(sync=True)
+            self.journal.close()
+        if getattr(self, "storage", None) is not None:
+            self.storage.close()
+
+    def _index(self, field: str): # хэш-таблица для поля
+        if field not in INDEX_ATTRS:
+            return None
+        return getattr(self, INDEX_ATTRS[field])
+
+    def _new_postings(self, field: str, offsets=()): # список адресов для нового ключа
+        return POSTINGS[field](offsets)
+
+    def _apply(self, op: str, field: str, key: str, offset: int): # изменение индексов без записи в журнал
+        if field:
+            self._generations[field] += 1  # ответы из кэша запросов по этому полю устарели
+        if op == "r+":
+            self.removed.append(offset)
+        elif op == "r-":
+            if self.removed and self.removed[-1] == offset:
+                self.removed.pop()
+            else:
+                self.removed.remove(offset)
+        elif field in self._unloaded:
+            self._buffer(field, op, key, [offset])
+        elif op == "+":
+            index = self._index(field)
+            if key not in index:
+                index[key] = self._new_postings(field)
+            index[key].append(offset)
+        elif op == "-":
+            self._index(field)[key].remove(offset)
+        elif op == "x":
+            del self._index(field)[key]
+
+    def _buffer(self, field: str, op: str, key: str, offsets: list): # изменение незагруженного индекса
+        pending = self._pending.setdefault(field, [])
+        pending.append((op, key, offsets))
+        if len(pending) > DELTA_MAX:
+            self._materialize(field)
+
+    def _materialize(self, field: str): # загрузка индекса поля и применение накопленных изменений
+        self.metrics.count("index_loads")
+        index = self._wrap(field, self._read_index(field))
+        if field in TEXT_FIELDS and self._snapshot is not None and self._snapshot.valid():
+            index.grams = self._snapshot.load_sets(field + " grams")  # n-граммы того же снимка
+        setattr(self, "_" + INDEX_ATTRS[field], index)
+        for op, key, offsets in self._pending.pop(field, []):
+            if op == "+":
+                if key in index:
+                    index[key].extend(offsets)
+                else:
+                    index[key] = self._new_postings(field, offsets)
+            elif op == "-":
+                for offset in offsets:
+                    index[key].remove(offset)
+            elif op == "x":
+                del index[key]
+        self._unloaded.discard(field)  # только теперь читатели без _load_lock увидят индекс
+
+    def _read_index(self, field: str): # индекс поля из двоичного снимка, при сбое - из CSV
+        index = None
+        if self._snapshot is not None and self._snapshot.valid():
+            index = self._snapshot.load_index(field, POSTINGS[field])
+        if index is None:
+            index = self.load_index(self.index_files[field])
+        return index
+
+    def _change(self, op: str, field: str = "", key: str = "", offset: int = None): # изменение индексов с записью в журнал
+        self._apply(op, field, key, offset)
+        if self.journal is not None:
+            self.journal.log(op, field, key, offset)
+
+    def _commit(self, sync: bool = False): # фиксация журнала после операции, снимок - когда журнал разросся
+        if self.journal is None or self._batch_depth:
+            return
+        self.journal.commit(sync)
+        if len(self.journal) > max(CHECKPOINT_MIN, len(self.indicesSN)):
+            self.checkpoint()
+        removed = len(self.removed)
+        if (self.compact_ratio is not None and removed >= COMPACT_MIN_REMOVED
+                and removed > self.compact_ratio * (removed + len(self.indicesSN))):
+            self.compact_background()
+
+    @contextmanager
+    def batch(self, sync: bool = False): # групповая фиксация: журнал сбрасывается один раз на все изменения блока
+        # with db.batch(): db.insert(...); db.delete(...) - sync=True ещё и fsync журнала
+        with self.lock.write():  # блок целиком - одно изменение для читателей
+            self._batch_depth += 1
+            try:
+                yield self
+            finally:
+                self._batch_depth -= 1
+                if not self._batch_depth:
+                    self._commit(sync)
+
     def load_removed(self, file_path: str): # загрузка removed из файла
         if file_path is None:
             return
@@ -64,11 +424,19 @@ class mydb:
             numbers_from_file = [int(line.strip()) for line in file]
         return numbers_from_file
 
+    @instrumented("load_index")
     def load_index(self, file_path: str): # загрузка хэш-таблиц из файла
         if file_path is None:
             return
         if not os.path.exists(file_path):
-            return {}
+            file_path = _legacy_path(file_path)
+            if file_path is None or not os.path.exists(file_path):
+                return {}
+
+        with open(file_path, "rb") as file:
+            if file.read(len(BITMAP_MAGIC)) == BITMAP_MAGIC:
+                file.seek(0)
+                return load_bitmap_index(file.read())
 
         index = {}
         with open(file_path, "r", newline="") as file:
@@ -81,7 +449,47 @@ class mydb:
         #print(index)
         return index
 
-    def save_indices(self): # сохранение всех индексов из ОЗУ в файлы
+    def _snapshot_paths(self) -> list: # файлы снимка индексов
+        paths = [self.index_files[field] for field in FIELDS] + [self.removed_path]
+        return [path for path in paths if path is not None]
+
+    def _binary_snapshot_path(self) -> str:
+        return service_files(self.index_files)[2]
+
+    def _open_binary_snapshot(self): # двоичный снимок, если он не устарел
+        if self.journal is None:
+            return None
+        snapshot = Snapshot(self._binary_snapshot_path(), self.journal.checkpoint, self._snapshot_paths())
+        return snapshot if snapshot.valid() else None
+
+    def files(self) -> dict: # файлы базы по ролям: данные, индексы, removed, журнал, снимок (для резервных копий)
+        files = {"Data": self.file_path}
+        files.update((role, path) for role, path in self.index_files.items() if path is not None)
+        journal_path, ckpt_path, snapshot_path = service_files(self.index_files)
+        files.update({"Journal": journal_path, "Checkpoint": ckpt_path, "Snapshot": snapshot_path})
+        return files
+
+    @writing
+    def ensure_snapshot(self): # двоичный снимок индексов на диске соответствует CSV-снимку
+        # нужен, чтобы копия файлов открывалась без разбора CSV-индексов
+        if self.journal is not None and self._open_binary_snapshot() is None:
+            self.checkpoint()
+
+    @instrumented("save_indices")
+    @writing
+    def save_indices(self): # сохранение изменений индексов (сброс журнала на диск)
+        if self.journal is None:
+            return
+        self.journal.commit(sync=True)
+
+        if self.storage is not None:
+            self.storage.flush()
+
+    @instrumented("checkpoint")
+    @writing
+    def checkpoint(self): # полная запись всех индексов из ОЗУ в файлы и очистка журнала
+        if self.journal is None:
+            return
         # словарь соответствий полей и хеш-таблиц
         indices_mapping = {
             "SN": (self.index_files["SN"], self.indicesSN),
@@ -91,164 +499,424 @@ class mydb:
             "Sold": (self.index_files["Sold"], self.indicesSOLD),
         }
 
+        if self.storage is not None:
+            self.storage.flush()
+
+        # новый снимок пишется во временные файлы и подменяет старый только после фиксации
         for field, (file_path, index) in indices_mapping.items():
-            if file_path is None:
-                return
-            with open(file_path, "w", newline="") as file:
+            if field in BITMAP_FIELDS:
+                save_bitmap_index(file_path + ".tmp", index)
+                continue
+            with open(file_path + ".tmp", "w", newline="") as file:
                 writer = csv.writer(file)
-                for key, offsets in index.items():
-                    writer.writerow([key] + offsets)
+                # упорядоченные индексы пишутся по порядку ключей: при загрузке сортировать нечего
+                keys = index.ordered() if isinstance(index, OrderedIndex) else index
+                for key in keys:
+                    writer.writerow([key, *index[key]])
 
-        with open(self.removed_path, "w") as file:
+        with open(self.removed_path + ".tmp", "w") as file:
             for number in self.removed:
                 file.write(f"{number}\n")
 
-    def _load_data(self) -> List[Dict[str, Any]]: # загрузка всех данных из БД (для gui)
+        generation = self.journal.generation + 1
+        # n-граммы сохраняются, если уже построены (был поиск по подстроке)
+        grams = {field + " grams": self._index(field).grams for field in TEXT_FIELDS
+                 if self._index(field).grams is not None}
+        save_snapshot(self._binary_snapshot_path() + ".tmp", generation,
+                      {field: self._index(field) for field in FIELDS}, POSTINGS, self.removed,
+                      [path + ".tmp" for path in self._snapshot_paths()], grams)
+
+        self.journal.mark(generation)
+        for path in self._snapshot_paths() + [self._binary_snapshot_path()]:
+            os.replace(path + ".tmp", path)
+            legacy = _legacy_path(path)
+            if legacy is not None and os.path.exists(legacy):
+                os.remove(legacy)  # индекс уже в файле с новым именем
+        self.journal.reset(generation)
+        self._snapshot = None  # все индексы уже в памяти
+
+    def iter_records(self, skip_removed: bool = True, chunk_size: int = 1 << 16, start: int = 0, stop: int = None):
+        # потоковое чтение (адрес, поля) в порядке файла; start/stop - адреса записей
+        # генератор не держит блокировку: согласованный проход - под with db.lock.read()
+        if self.file_path is None:
+            return
+        yield from self.storage.records(start, stop, chunk_size, skip_removed)
+
+    @reading
+    def page(self, start: int = 0, limit: int = 100): # окно записей для постраничного просмотра
+        # возвращает [(адрес, поля)] и адрес начала следующей страницы (None - страница последняя)
+        rows = []
+        for offset, fields in self.iter_records(start=start):
+            if len(rows) == limit:
+                return rows, offset
+            rows.append((offset, fields))
+        return rows, None
+
+    @reading
+    def count(self) -> int: # число живых записей
+        if self.indicesSN is None:
+            return 0
+        return len(self.indicesSN)
+
+    @reading
+    def _load_data(self) -> List[List[str]]: # загрузка всех данных из БД
         if self.file_path is None:
             return
-        table = []
-        with open(self.file_path, "r") as file:
-            lines = file.readlines()
-            for line in lines:
-                if not line.startswith("------") and not line.startswith("SN"):
-                    line.strip()
-                    table.append(list(line.split(',')))
-                    #reader = csv.DictReader(file)
-            #return list(reader)
-        #print(table)
-        return table
-
-
-    def _load_data_all(self) -> List[Dict[str, Any]]: # с учётом пустых строчек
+        return [fields for _, fields in self.iter_records()]
+
+
+    @reading
+    def _load_data_all(self) -> List[List[str]]: # с учётом пустых строчек
         if self.file_path is None:
             return
-        table = []
-        with open(self.file_path, "r") as file:
-            lines = file.readlines()
-            for line in lines:
-                if not line.startswith("SN"):
-                    line.strip()
-                    line = line[:-1]
-                    table.append(list(line.split(',')))
-                    #reader = csv.DictReader(file)
-            #return list(reader)
-        #print(table)
-        return table
+        return [fields for _, fields in self.iter_records(skip_removed=False)]
 
 
+    @instrumented("search")
+    @reading
     def search(self, field: str, value: str) -> list[dict]: # поиск записей по полю
         #print(value)
 
-        if field == "Compliance Index":
-            index = self.indicesIND
-
-        else:
-            index = getattr(self, f"indices{field.upper()}", None)
+        index = self._index(field)
         if index is None:
             return []
 
+        key = ("search", field, str(value))
+        cached = self._cached_query(key)
+        if cached is not None:
+            return cached
+
         # получаем список смещений для заданного значения
         offsets = index.get(str(value), [])
         #print(offsets)
         if not offsets:
+            self.metrics.count("index_misses")
+            self._remember_query(key, (field,), [], [])
             return []
+        self.metrics.count("index_hits")
+
+
+        results = []
+        found = []
+        for offset in offsets:
+            fields = self.storage.read(offset)
+            if fields is not None and fields[0] != REMOVED_SN:
+                results.append(dict(zip(FIELDS, fields)))
+                found.append(offset)
+
+        self._remember_query(key, (field,), found, results)
+        return results
 
+    def _cached_query(self, key): # ответ из кэша запросов (None - нет или устарел)
+        if self.query_cache is None:
+            return None
+        entry = self.query_cache.get(key, self._generations)
+        if entry is None:
+            self.metrics.count("query_cache_misses")
+            return None
+        self.metrics.count("query_cache_hits")
+        if entry.records is not None:
+            return [dict(record) for record in entry.records]  # копии: вызывающий может их менять
+        return self._read_records(entry.offsets)
+
+    def _remember_query(self, key, fields, offsets: list, results: list):
+        if self.query_cache is None:
+            return
+        records = [dict(record) for record in results] if self.query_cache.mode == "records" else None
+        self.query_cache.put(key, fields, self._generations, offsets, records)
 
+    def _read_records(self, offsets) -> list[dict]: # живые записи по адресам, файл открывается один раз
         results = []
-        with open(self.file_path, "r") as file:
-            for offset in offsets:
-                file.seek(offset)
-                line = file.readline().strip()
-                if line[0] != "------":
-                    results.append(dict(zip(["SN", "Name", "Date", "Compliance Index", "Sold"], line.split(","))))
+        for offset, fields in self.storage.read_many(offsets):
+            if fields[0] != REMOVED_SN:
+                results.append(dict(zip(FIELDS, fields)))
+        return results
 
+    @instrumented("search_text")
+    @reading
+    def search_text(self, field: str, text: str, mode: str = "prefix") -> list[dict]:
+        # поиск по части значения: mode "prefix" - начинается с text, "contains" - содержит text
+        index = self._index(field)
+        if not isinstance(index, TextIndex):
+            raise ValueError(f"Поле {field} не поддерживает поиск по части значения.")
+        if mode not in ("prefix", "contains"):
+            raise ValueError(f"Неизвестный режим поиска: {mode}")
+
+        key = ("text", field, mode, text)
+        cached = self._cached_query(key)
+        if cached is not None:
+            return cached
+
+        keys = index.prefix(text) if mode == "prefix" else index.contains(text)
+        offsets = sorted(offset for value in keys for offset in index[value])
+        results = self._read_records(offsets)
+        self._remember_query(key, (field,), offsets, results)
         return results
 
-    def insert(self, record: dict): # вставка новой записи
+    def iter_ordered(self, field: str, lo: str = None, hi: str = None): # записи по возрастанию поля (lo <= значение <= hi)
+        index = self._index(field)
+        if not isinstance(index, OrderedIndex):
+            raise ValueError(f"Поле {field} не поддерживает поиск по диапазону.")
+
+        for key in index.irange(lo, hi):
+            for offset in sorted(index[key]):
+                fields = self.storage.read(offset)
+                if fields is not None and fields[0] != REMOVED_SN:
+                    yield dict(zip(FIELDS, fields))
+
+    @reading
+    def search_range(self, field: str, lo: str = None, hi: str = None) -> list[dict]: # поиск по диапазону значений
+        return list(self.iter_ordered(field, lo, hi))
+
+    # Запрос из нескольких условий: ("and" | "or", условие, условие, ...), вложенные
+    # условия допускаются. Условие на поле - (поле, значение) или (поле, от, до) для Date
+    # и Compliance Index. Пример: ("and", ("Name", "AB12CD"), ("Sold", "+"))
+    @instrumented("query")
+    @reading
+    def query(self, expr) -> list[dict]:
+        try:
+            key = ("query", expr)
+            hash(key)
+        except TypeError:
+            key = None  # условия заданы списками - такой запрос не кэшируется
+        if key is not None:
+            cached = self._cached_query(key)
+            if cached is not None:
+                return cached
+
+        offsets = sorted(self._query_offsets(expr))
+        # строки читаются в порядке смещений, файл открывается один раз
+        results = self._read_records(offsets)
+        if key is not None:
+            self._remember_query(key, self._query_fields(expr), offsets, results)
+        return results
+
+    def _query_fields(self, expr) -> set: # поля, от которых зависит ответ на запрос
+        if expr[0] in ("and", "or"):
+            return set().union(*(self._query_fields(sub) for sub in expr[1:]))
+        return {expr[0]}
+
+    # Агрегаты по индексам без чтения файла данных: {значение group_by (None - без группировки): {функция: результат}}.
+    # funcs - из "count", "sum", "avg", "min", "max" (все, кроме count, - по полю value), where - условие как в query().
+    # Пример: средний индекс соответствия непроданных - aggregate(value="Compliance Index", funcs=("avg",), where=("Sold", "-"))
+    @instrumented("aggregate")
+    @reading
+    def aggregate(self, group_by: str = None, value: str = None, funcs=("count",), where=None) -> dict:
+        unknown = set(funcs) - set(AGGREGATES)
+        if unknown:
+            raise ValueError(f"Неизвестные агрегаты: {', '.join(sorted(unknown))}")
+        if value is None and set(funcs) - {"count"}:
+            raise ValueError("Для sum, avg, min и max нужно поле value.")
+
+        within = None if where is None else self._query_offsets(where)
+        groups = None if group_by is None else self._field_postings(group_by)
+        if value is None:
+            if groups is None:
+                total = self.count() if within is None else len(within)
+                return {None: {"count": total}} if total else {}
+            return {key: {"count": count} for key, count in counts(groups, within).items()}
+
+        values = self._field_postings(value)
+        keys = value_keys(values)
+        numbers = numbers_of(value, keys) if {"sum", "avg"} & set(funcs) else None
+        return rows(accumulate(groups, values, keys, numbers, within), keys, funcs)
+
+    def _field_postings(self, field: str): # индекс поля; без индекса - один проход по файлу данных
+        if field not in FIELDS:
+            raise ValueError(f"Поле {field} не существует.")
+        index = self._index(field)
+        if index is not None:
+            return index
+        return merge_postings(self._scan(field_range, FIELDS.index(field)))
+
+    def _postings(self, expr) -> list: # списки адресов, подходящие под условие на одно поле
+        field = expr[0]
+        index = self._index(field)
+        if index is None:
+            raise ValueError(f"Индекс для поля {field} не существует.")
+        if len(expr) == 2:
+            offsets = index.get(str(expr[1]))
+            return [offsets] if offsets else []
+        if not isinstance(index, OrderedIndex):
+            raise ValueError(f"Поле {field} не поддерживает поиск по диапазону.")
+        return [index[key] for key in index.irange(expr[1], expr[2])]
+
+    def _estimate(self, expr) -> int: # оценка числа записей по размерам списков в индексах
+        if expr[0] == "and":
+            return min(self._estimate(sub) for sub in expr[1:])
+        if expr[0] == "or":
+            return sum(self._estimate(sub) for sub in expr[1:])
+        return sum(len(offsets) for offsets in self._postings(expr))
+
+    def _query_offsets(self, expr, within: set = None) -> set:
+        if expr[0] == "and":
+            # сначала самое избирательное условие, дальше только сужаем найденное
+            result = within
+            for sub in sorted(expr[1:], key=self._estimate):
+                if result is not None and not result:
+                    break
+                result = self._query_offsets(sub, result)
+            return result if result is not None else set()
+        if expr[0] == "or":
+            result = set()
+            for sub in expr[1:]:
+                result |= self._query_offsets(sub, within)
+            return result
+
+        result = set()
+        for offsets in self._postings(expr):
+            if within is not None and len(within) < len(offsets) and isinstance(offsets, Bitmap):
+                result.update(offset for offset in within if offset in offsets)
+            else:
+                result.update(offsets)
+        if within is not None:
+            result &= within
+        return result
+
+    @instrumented("insert")
+    @writing
+    def insert(self, record: dict): # вставка новой записи, возвращает её адрес
         if record["SN"] in self.indicesSN:
             print("Значение первичного ключа должно быть уникальным")
             return
 
-        if len(self.removed) == 0:
-            with open(self.file_path, "a", newline="") as file:
-                writer = csv.writer(file)
-                # получаем текущее смещение перед записью
-                offset = file.tell()
-                writer.writerow(record.values())
+        values = [record[field] for field in FIELDS]
+
+        # если есть удаленные записи, вставка пойдет вместо них
+        # (в csv только на строку той же длины, иначе испортится соседняя строка)
+        offset = next((o for o in reversed(self.removed) if self.storage.fits(o, values)), None)
+        if offset is None:
+            offset = self.storage.append(values)
         else:
-            # если есть удаленные записи, вставка пойдет вместо них
-            offset = self.removed.pop()
-            with open(self.file_path, "r+", newline="") as file:
-                file.seek(offset)
-                writer = csv.writer(file)
-                writer.writerow(record.values())
+            self.storage.write(offset, values)  # сначала запись: если поля не влезли, слот остаётся свободным
+            self.metrics.count("slot_reuse")
+            self._change("r-", offset=offset)
 
 
         # ОБНОВЛЕНИЕ ТАБЛИЦ
-        for field, value in record.items():
-            if field == "Compliance Index":
-                index = self.indicesIND
-            else:
-                index = getattr(self, f"indices{field.upper()}", None)
-
-            if index is not None:
-                if value not in index:
-                    index[value] = []
-                index[value].append(offset)
-
-    def update(self, record: dict): # обновление записи по SN
+        for field, value in zip(FIELDS, values):
+            self._change("+", field, value, offset)
+
+        self._commit()
+        return offset
+
+    @instrumented("insert_many")
+    def insert_many(self, records, batch_size: int = 10000) -> int: # пакетная вставка (список или генератор), возвращает число вставленных
+        inserted = 0
+        batch = []
+        # блокировка записи берётся на каждую пачку: между пачками успевают пройти чтения
+        for record in records:
+            batch.append(record)
+            if len(batch) >= batch_size:
+                inserted += self._insert_locked(batch)
+                batch = []
+        if batch:
+            inserted += self._insert_locked(batch)
+        return inserted
+
+    @writing
+    def _insert_locked(self, records: list) -> int:
+        inserted = self._insert_batch(records)
+        self._commit()
+        return inserted
+
+    def _insert_batch(self, records: list) -> int:
+        # проверка уникальности SN сразу для всей пачки
+        rows = []
+        seen = set()
+        for record in records:
+            if record["SN"] in seen or record["SN"] in self.indicesSN:
+                print(f"Значение первичного ключа должно быть уникальным: {record['SN']}")
+                continue
+            seen.add(record["SN"])
+            rows.append([record[field] for field in FIELDS])
+        for row in rows:  # неверная запись останавливает пачку до записи в файл, а не на середине
+            self.storage.check(row)
+
+        # сначала заполняются удалённые слоты, остальное дописывается в конец одной записью
+        offsets = [None] * len(rows)
+        reused = list(zip(reversed(self.removed), rows))
+        taken = set()
+        for i, ((offset, _), placed) in enumerate(zip(reused, self.storage.write_many(reused))):
+            if placed:
+                offsets[i] = offset
+                taken.add(offset)
+        tail = [i for i, offset in enumerate(offsets) if offset is None]
+        for i, offset in zip(tail, self.storage.append_many([rows[i] for i in tail])):
+            offsets[i] = offset
+
+        entries = [("r-", "", "", taken)] if taken else []
+        self.metrics.count("slot_reuse", len(taken))
+        if taken:
+            self.removed = [offset for offset in self.removed if offset not in taken]
+
+        # слияние с индексами: одно обращение к каждому ключу
+        merged = [{} for _ in FIELDS]
+        for offset, values in zip(offsets, rows):
+            for field_merged, value in zip(merged, values):
+                if value in field_merged:
+                    field_merged[value].append(offset)
+                else:
+                    field_merged[value] = [offset]
+        for field, field_merged in zip(FIELDS, merged):
+            pending = self._pending.get(field, [])
+            if field in self._unloaded and len(pending) + len(field_merged) <= DELTA_MAX:
+                # индекс не загружен - пачка уходит в буфер изменений
+                pending.extend(("+", key, key_offsets) for key, key_offsets in field_merged.items())
+                self._pending[field] = pending
+                entries.extend(("+", field, key, key_offsets) for key, key_offsets in field_merged.items())
+                continue
+            index = self._index(field)
+            kind = POSTINGS[field]
+            new = {}  # новые ключи добавляются разом: упорядоченный индекс сливает их за один проход
+            for key, key_offsets in field_merged.items():
+                if key in index:
+                    index[key].extend(key_offsets)
+                else:
+                    new[key] = kind(key_offsets)
+                entries.append(("+", field, key, key_offsets))
+            index.update(new)
+
+        if rows:
+            for field in FIELDS:
+                self._generations[field] += 1
+
+        if self.journal is not None:
+            self.journal.log_many(entries)
+        return len(rows)
+
+    @instrumented("update")
+    @writing
+    def update(self, record: dict): # обновление записи по SN, возвращает её (возможно новый) адрес
         if record["SN"] not in self.indicesSN:
             raise ValueError(f"Запись с ID={record['SN']} не найдена.")
 
         offset = self.indicesSN[record["SN"]][0]
+        values = [record[field] for field in FIELDS]
 
-        with open(self.file_path, "r+") as file:
-            file.seek(offset)
-            line = file.readline().strip()
-            fields = line.split(",")
+        fields = self.storage.read(offset)
 
-            #print(offset)
-            #print(self.indicesNAME[fields[1]])
-            #print(self.indicesDATE[fields[2]])
-            #print(self.indicesIND[fields[3]])
-            #print(self.indicesSOLD[fields[4]])
+        if self.storage.fits(offset, values):
+            new_offset = offset
+            self.storage.write(offset, values)
+        else:
+            # строка другой длины переносится в конец файла
+            self.storage.erase(offset)
+            self._change("r+", offset=offset)
+            new_offset = self.storage.append(values)
 
-            name = fields[1]
-            if (name != record['Name']):
-                self.indicesNAME[name].remove(offset)
-                if record['Name'] not in self.indicesNAME:
-                    self.indicesNAME[record['Name']] = []
-                self.indicesNAME[record['Name']].append(offset)
+        for field, old, value in zip(FIELDS, fields, values):
+            if old != value or new_offset != offset:
+                self._change("-", field, old, offset)
+                self._change("+", field, value, new_offset)
 
-            date = fields[2]
-            if (date != record['Date']):
-                self.indicesDATE[date].remove(offset)
-                if record['Date'] not in self.indicesDATE:
-                    self.indicesDATE[record['Date']] = []
-                self.indicesDATE[record['Date']].append(offset)
+        self._commit()
+        return new_offset
 
-            ind = fields[3]
-            if (ind != record['Compliance Index']):
-                self.indicesIND[ind].remove(offset)
-                if record['Compliance Index'] not in self.indicesIND:
-                    self.indicesIND[record['Compliance Index']] = []
-                self.indicesIND[record['Compliance Index']].append(offset)
-
-            sold = fields[4]
-            if (sold != record['Sold']):
-                self.indicesSOLD[sold].remove(offset)
-                if record['Sold'] not in self.indicesSOLD:
-                    self.indicesSOLD[record['Sold']] = []
-                self.indicesSOLD[record['Sold']].append(offset)
-
-            file.seek(offset)
-            file.write(",".join(record.values()) + "\n")
-
-    def delete(self, field: str, value: str): # удаление записи по полю-значению
-        if field == "Compliance Index":
-            index = self.indicesIND
-        else:
-            index = getattr(self, f"indices{field.upper()}", None)
+    @instrumented("delete")
+    @writing
+    def delete(self, field: str, value: str): # удаление записи по полю-значению, возвращает адреса удалённых
+        index = self._index(field)
 
         if index is None:
             raise ValueError(f"Индекс для поля {field} не существует.")
@@ -257,58 +925,143 @@ class mydb:
         offsets = index.get(value, [])
         if not offsets:
             print(f"Записи с {field} = {value} не найдены.")
-            return  # если нет записей
-
-        with open(self.file_path, "r+") as file:
-            for offset in sorted(offsets):
-                file.seek(offset)
-
-                line = file.readline()
-                #print(f"Processing line at offset {offset}: {line.strip()}")
+            return []  # если нет записей
 
-                if not line:
-                    print(f"Ошибка: строка по смещению {offset} не найдена!")
-                    continue
+        deleted = []
+        for offset in sorted(offsets):
+            fields = self.storage.read(offset)
+            #print(f"Processing line at offset {offset}: {fields}")
 
-                fields = line.strip().split(",")
+            if fields is None:
+                print(f"Ошибка: строка по смещению {offset} не найдена!")
+                continue
 
-                SN = fields[0]
-                if SN in self.indicesSN:
-                    del self.indicesSN[SN]
+            SN = fields[0]
+            if SN in self.indicesSN:
+                self._change("x", "SN", SN)
 
-                name = fields[1]
-                self.indicesNAME[name].remove(offset)
-
-                date = fields[2]
-                self.indicesDATE[date].remove(offset)
+            name = fields[1]
+            self._change("-", "Name", name, offset)
 
-                ind = fields[3]
-                self.indicesIND[ind].remove(offset)
+            date = fields[2]
+            self._change("-", "Date", date, offset)
 
-                sold = fields[4]
-                self.indicesSOLD[sold].remove(offset)
+            ind = fields[3]
+            self._change("-", "Compliance Index", ind, offset)
 
-                # обновляем строку, заменяя SN на "------"
-                fields[0] = "------"
-                updated_line = ",".join(fields) + "\n"
+            sold = fields[4]
+            self._change("-", "Sold", sold, offset)
 
-                file.seek(offset)
-                file.write(updated_line)
+            # помечаем запись удалённой, заменяя SN на "------"
+            self.storage.erase(offset)
 
-                self.removed.append(offset)
+            self._change("r+", offset=offset)
+            deleted.append(offset)
 
 
-            if (field == "Name"):
-                del self.indicesNAME[value]
-            elif (field == "Date"):
-                del self.indicesDATE[value]
-            elif (field == "Compliance Index"):
-                del self.indicesIND[value]
-            elif (field == "Sold"):
-                del self.indicesSOLD[value]
+        if field != "SN":
+            self._change("x", field, value)
 
+        self._commit()
+        return deleted
 
-        # self.save_indices()
+    def _scan(self, task, *args, workers: int = None) -> list: # проход по файлу данных частями в нескольких процессах
+        if self.file_path is None:
+            return []
+        return scan(self.storage, task, *args, workers=workers)
+
+    @writing
+    def rebuild_indices(self, workers: int = None): # построение всех индексов заново по файлу данных
+        # части файла разбираются параллельно, старые индексы не загружаются
+        indices, self.removed = merge_indices(self._scan(index_range, workers=workers))
+        for field in FIELDS:
+            setattr(self, INDEX_ATTRS[field], indices[field])
+        self.checkpoint()
+
+    @instrumented("compact")
+    @writing
+    def compact(self, workers: int = None): # удалённые записи убираются из файла данных, индексы строятся заново
+        if self.file_path is None:
+            return
+        self._stop_compaction()
+        # живые записи частей файла собираются процессами и потоком пишутся в новый файл
+        self.storage.rewrite_raw(scan_iter(self.storage, live_range, workers=workers))
+        self.rebuild_indices(workers)
+
+    @writing
+    def compact_background(self, segment_bytes: int = SEGMENT_BYTES): # сжатие в фоновом потоке, возвращает Compaction
+        # поиск и изменения во время сжатия не останавливаются; уже идущее сжатие не перезапускается
+        # None - сжатие сейчас невозможно (нет файла или идёт выгрузка)
+        if self.file_path is None or self._streams:
+            return None
+        if self._compaction is None or self._compaction.done():
+            self.metrics.count("background_compactions")
+            self._compaction = Compaction(self, segment_bytes).start()
+        return self._compaction
+
+    @property
+    def compaction(self): # последнее фоновое сжатие (идущее или завершённое), None - не запускалось
+        return self._compaction
+
+    @contextmanager
+    def streaming(self): # with db.streaming(): проход iter_records без блокировки, фоновое сжатие файл не подменит
+        with self.lock.write():
+            self._stop_compaction()
+            self._streams += 1
+        try:
+            yield
+        finally:
+            with self.lock.write():
+                self._streams -= 1
+
+    def _stop_compaction(self): # под блокировкой записи: файл сейчас сменится - фоновое сжатие бросается
+        compaction = getattr(self, "_compaction", None)
+        if compaction is not None and not compaction.done():
+            compaction.cancel()
+        self._compaction = None
+
+    def _replace_indices(self, indices: dict, removed: list): # готовые индексы (после _wrap) вместо текущих
+        for field in FIELDS:
+            setattr(self, "_" + INDEX_ATTRS[field], indices[field])
+            self._unloaded.discard(field)
+            self._pending.pop(field, None)
+            self._generations[field] += 1
+        self.removed = removed
+
+    @writing
+    def clear(self): # удаление всех записей: пустой файл данных и пустые индексы
+        if self.file_path is None:
+            return
+        self._stop_compaction()  # иначе сжатие подменит пустой файл старыми записями
+        self.storage.reset()
+        for field in FIELDS:
+            setattr(self, INDEX_ATTRS[field], {})
+        self.removed = []
+        self.checkpoint()
+
+    @reading
+    def filter(self, predicate, workers: int = None) -> list[dict]: # записи, для которых predicate(запись) истинно
+        # полный проход по файлу без индексов; predicate - функция уровня модуля (уходит в процессы)
+        return [dict(zip(FIELDS, fields)) for part in self._scan(filter_range, predicate, workers=workers)
+                for _, fields in part]
+
+    @writing
+    def convert(self, file_path: str, kind: str): # перенос БД в другой формат хранения ("csv" или "bin")
+        self._stop_compaction()
+        target, mapping = convert_storage(self.storage, file_path, kind)
+        for field in FIELDS:
+            index = self._index(field)
+            for key in index:
+                index[key] = self._new_postings(field, (mapping[offset] for offset in index[key]))
+        self.removed = [mapping[offset] for offset in self.removed]
+        for field in FIELDS:
+            self._generations[field] += 1
+        self.storage.close()
+        self.storage = target
+        self._attach(self.storage)
+        self.file_path = file_path
+        # адреса поменялись целиком - журнал заменяется новым снимком
+        self.checkpoint()
 
 
 def measure_operations(db, n: int):
@@ -321,7 +1074,14 @@ def measure_operations(db, n: int):
         db.insert(record)
     insert_time = time.time() - start_time
 
-    print(f"Time for {n} inserts: {insert_time:.4f} seconds")
+    print(f"Time for {n} inserts: {insert_time:.4f} seconds ({n / insert_time:.0f} records/s)")
+
+    # ВРЕМЯ ПАКЕТНОЙ ВСТАВКИ
+    start_time = time.time()
+    db.insert_many(generate_random_record(sn) for sn in range(n + 1, 2 * n + 1))
+    insert_many_time = time.time() - start_time
+
+    print(f"Time for insert_many of {n} records: {insert_many_time:.4f} seconds ({n / insert_many_time:.0f} records/s)")
 
     # ВРЕМЯ ПОИСКА
     search_key = records[n // 2]["Name"]  # поиск по имени из середины списка
@@ -360,8 +1120,8 @@ if __name__ == "__main__":
         "SN": "index_sn.csv",
         "Name": "index_name.csv",
         "Date": "index_date.csv",
-        "Compliance Index": "index_compliance_index.csv",
-        "Sold": "index_sold.csv",
+        "Compliance Index": "index_compliance_index.bm",
+        "Sold": "index_sold.bm",
         "Removed": "removed.txt",
     }
 
@@ -0,0 +1,262 @@
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+from bd import INDEX_ATTRS, mydb, default_index_paths, generate_random_record
+from export import ExportJob, Workbook, export as run_export
+from storage import FIELDS
+
+try:
+    import resource  # пиковая память процесса (нет в Windows)
+except ImportError:
+    resource = None
+
+
+DEFAULT_SIZES = [10000, 100000]  # полный прогон: --sizes 10000 100000 1000000 10000000
+DEFAULT_OPS = 1000  # замеров на операцию с одиночными вызовами
+DEFAULT_THRESHOLD = 0.2  # на сколько (доля) можно отстать от эталона, дальше - регрессия
+SEARCH_RECORDS = 100000  # сколько найденных записей хватит для замера поиска по одному полю
+# по каким показателям сравнивать с эталоном: задержка - чем меньше, тем лучше
+COMPARED = ("p50_ms", "p95_ms")
+
+
+def percentile(ordered: list, share: float) -> float: # значение по рангу в отсортированном списке
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, int(share * len(ordered)))]
+
+
+def summary(latencies: list, items: int = None) -> dict: # p50/p95/p99 и пропускная способность
+    # latencies - секунды на вызов; items - сколько записей обработано всеми вызовами
+    ordered = sorted(latencies)
+    total = sum(ordered)
+    items = len(ordered) if items is None else items
+    return {
+        "count": len(ordered),
+        "items": items,
+        "total_s": round(total, 6),
+        "ops_per_s": round(items / total, 1) if total else None,
+        "p50_ms": round(percentile(ordered, 0.50) * 1000, 4),
+        "p95_ms": round(percentile(ordered, 0.95) * 1000, 4),
+        "p99_ms": round(percentile(ordered, 0.99) * 1000, 4),
+    }
+
+
+def timed(func, *args): # (время вызова в секундах, результат)
+    start = time.perf_counter()
+    result = func(*args)
+    return time.perf_counter() - start, result
+
+
+def search_summary(db, field, keys) -> dict: # поиск по каждому различному ключу один раз
+    # ключи с большими ответами (Sold - половина таблицы) не повторяются на каждую запись выборки,
+    # а замер заканчивается, когда найдено SEARCH_RECORDS записей; records_per_s сравним для любых ответов
+    latencies = []
+    found = 0
+    for key in dict.fromkeys(keys):
+        elapsed, records = timed(db.search, field, key)
+        latencies.append(elapsed)
+        found += len(records)
+        if found >= SEARCH_RECORDS:
+            break
+    stats = summary(latencies)
+    stats["records"] = found
+    stats["records_per_s"] = round(found / stats["total_s"], 1) if stats["total_s"] else None
+    return stats
+
+
+def peak_rss_kb():
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss // 1024 if sys.platform == "darwin" else rss  # в macOS байты, в Linux килобайты
+
+
+def export(db, file_path: str): # выгрузка, как в интерфейсе: xlsx, если есть openpyxl, иначе csv
+    return run_export(db, file_path + (".xlsx" if Workbook is not None else ".csv"))
+
+
+def bench_size(size: int, ops: int, kind: str, directory: str) -> dict: # все операции на таблице из size записей
+    paths = default_index_paths(directory)
+    open(paths["Removed"], "w").close()
+    data_path = os.path.join(directory, "database." + ("mydb" if kind == "bin" else "csv"))
+    # кэши выключены: замеры поиска не должны попадать в кэш, заполненный выборкой ключей
+    db = mydb(data_path, paths, kind, cache_bytes=0, query_cache=None)
+    results = {}
+
+    # таблица заполняется пакетно, одиночные операции меряются уже на полной таблице
+    elapsed, _ = timed(db.insert_many, (generate_random_record(sn) for sn in range(1, size + 1)))
+    results["insert_many"] = summary([elapsed], size)
+
+    ops = min(ops, size)
+    latencies = []
+    for sn in range(size + 1, size + ops + 1):
+        elapsed, _ = timed(db.insert, generate_random_record(sn))
+        latencies.append(elapsed)
+    results["insert"] = summary(latencies)
+
+    # ключи поиска берутся из существующих записей (случайные SN из пакетной вставки)
+    sample = []
+    for sn in random.sample(range(1, size + 1), ops):
+        record = db.search("SN", f"{sn:06d}")[0]
+        sample.append([record[field] for field in FIELDS])
+    for position, field in enumerate(FIELDS):
+        results[f"search[{field}]"] = search_summary(db, field, [fields[position] for fields in sample])
+
+    latencies = []
+    for fields in sample:
+        record = dict(zip(FIELDS, fields))
+        record["Name"] = generate_random_record(0)["Name"]
+        record["Sold"] = "-" if record["Sold"] == "+" else "+"
+        elapsed, _ = timed(db.update, record)
+        latencies.append(elapsed)
+    results["update"] = summary(latencies)
+
+    latencies = []
+    for fields in sample:
+        elapsed, _ = timed(db.delete, "SN", fields[0])
+        latencies.append(elapsed)
+    results["delete"] = summary(latencies)
+
+    elapsed, _ = timed(db.save_indices)
+    results["save_indices"] = summary([elapsed])
+
+    elapsed, _ = timed(db.checkpoint)
+    results["checkpoint"] = summary([elapsed])
+
+    # сжатие - как "Hard erase" в интерфейсе: перезапись живых записей и перестройка индексов
+    elapsed, _ = timed(db.compact)
+    results["compaction"] = summary([elapsed], db.count())
+
+    elapsed, _ = timed(export, db, os.path.join(directory, "export"))
+    results["export"] = summary([elapsed], db.count())
+
+    # вставки во время фоновой выгрузки: запись не ждёт выгрузку, а выгрузка переживает дозапись
+    job = ExportJob(db, os.path.join(directory, "export-live.csv")).start()
+    latencies = []
+    for sn in range(size + ops + 1, size + 2 * ops + 1):
+        if job.done():
+            break
+        elapsed, _ = timed(db.insert, generate_random_record(sn))
+        latencies.append(elapsed)
+    job.wait()
+    if job.error is not None:
+        raise job.error
+    results["insert during export"] = summary(latencies)
+
+    # запуск: открытие (индексы ленивые) и открытие с загрузкой всех индексов
+    db.close()
+    elapsed, db = timed(mydb, data_path, paths, kind)
+    results["open"] = summary([elapsed])
+    start = time.perf_counter()
+    for attr in ("indicesSN", "indicesNAME", "indicesDATE", "indicesIND", "indicesSOLD"):
+        getattr(db, attr)
+    results["open+load"] = summary([elapsed + time.perf_counter() - start])
+
+    # поиск с кэшами по умолчанию (как в интерфейсе): первый проход заполняет кэши, меряется повторный;
+    # поле, ответ по которому не помещается в кэш запросов (Sold), не меряется: его "повтор" - тот же
+    # поиск без кэша, к тому же вытесняющий кэш записей
+    rows, _ = db.page(0, ops)
+    db.metrics.enabled = True  # доля попаданий в кэш запросов - из счётчиков метрик
+    for position, field in enumerate(FIELDS):
+        keys = list(dict.fromkeys(fields[position] for _, fields in rows))
+        index = getattr(db, INDEX_ATTRS[field])
+        sizes = [len(index.get(key, ())) for key in keys]  # размер ответа - по индексу, без чтения записей
+        if not all(db.query_cache.admits(size, len(FIELDS)) for size in sizes):
+            results[f"search[{field}] cached"] = f"не кэшируется: ответ до {max(sizes)} записей"
+            continue
+        for key in keys:
+            db.search(field, key)
+        db.metrics.reset()
+        stats = search_summary(db, field, keys)
+        stats["query_cache_hit_ratio"] = db.metrics.snapshot()["ratios"]["query_cache_hit_ratio"]
+        results[f"search[{field}] cached"] = stats
+    db.metrics.enabled = False
+    db.close()
+
+    results["peak_rss_kb"] = peak_rss_kb()
+    return results
+
+
+def compare(current: dict, baseline: dict, threshold: float) -> list: # операции, ставшие медленнее эталона
+    regressions = []
+    for size, operations in current["results"].items():
+        base_operations = baseline.get("results", {}).get(size, {})
+        for operation, stats in operations.items():
+            base = base_operations.get(operation)
+            if not isinstance(stats, dict) or not isinstance(base, dict):
+                continue
+            for metric in COMPARED:
+                if base.get(metric) and stats[metric] > base[metric] * (1 + threshold):
+                    regressions.append((size, operation, metric, base[metric], stats[metric]))
+    return regressions
+
+
+def run(sizes, ops: int = DEFAULT_OPS, kind: str = "csv", seed: int = 0) -> dict:
+    random.seed(seed)
+    report = {
+        "meta": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "storage": kind,
+            "ops": ops,
+            "seed": seed,
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        },
+        "results": {},
+    }
+    for size in sizes:
+        directory = tempfile.mkdtemp(prefix="mydb-bench-")
+        try:
+            print(f"Размер {size}...")
+            report["results"][str(size)] = results = bench_size(size, ops, kind, directory)
+        finally:
+            shutil.rmtree(directory, ignore_errors=True)
+        for operation, stats in results.items():
+            if isinstance(stats, dict):
+                print(f"  {operation:<32} p50 {stats['p50_ms']:>10.3f} ms  p95 {stats['p95_ms']:>10.3f} ms  "
+                      f"p99 {stats['p99_ms']:>10.3f} ms  {stats['ops_per_s'] or 0:>12.0f} /s"
+                      + (f"  {stats['records_per_s'] or 0:>12.0f} зап/с" if "records_per_s" in stats else "")
+                      + (f"  попадания {stats['query_cache_hit_ratio']}" if "query_cache_hit_ratio" in stats else ""))
+            elif isinstance(stats, str):
+                print(f"  {operation:<32} {stats}")
+        print(f"  пиковая память: {results['peak_rss_kb']} КБ")
+    return report
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Замеры производительности mydb")
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES, help="размеры таблицы")
+    parser.add_argument("--ops", type=int, default=DEFAULT_OPS, help="замеров на одиночную операцию")
+    parser.add_argument("--storage", choices=["csv", "bin"], default="csv", help="формат хранения")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", default="bench.json", help="файл с результатами (JSON)")
+    parser.add_argument("--baseline", help="эталонный JSON для сравнения")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD, help="допустимое замедление (доля)")
+    args = parser.parse_args(argv)
+
+    report = run(args.sizes, args.ops, args.storage, args.seed)
+    with open(args.out, "w") as file:
+        json.dump(report, file, indent=2)
+    print(f"Результаты сохранены: {args.out}")
+
+    if not args.baseline:
+        return 0
+    with open(args.baseline, "r") as file:
+        baseline = json.load(file)
+    regressions = compare(report, baseline, args.threshold)
+    for size, operation, metric, base, value in regressions:
+        print(f"РЕГРЕССИЯ {size} {operation} {metric}: {base} -> {value}")
+    if not regressions:
+        print("Регрессий относительно эталона нет.")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
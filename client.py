@@ -0,0 +1,142 @@
+import asyncio
+import itertools
+import socket
+
+from protocol import DEFAULT_PORT, pack, read_message, recv_message
+
+# Клиенты сервера mydb (server.py). Адрес - путь Unix-сокета (строка)
+# или пара (хост, порт); по умолчанию - localhost:DEFAULT_PORT.
+# Ошибка на сервере возвращается как ValueError с её текстом.
+
+
+def _result(reply):
+    _, ok, result = reply
+    if not ok:
+        raise ValueError(result)
+    return result
+
+
+class Client: # блокирующий клиент; pipeline() - много запросов за один обмен
+    def __init__(self, address=("127.0.0.1", DEFAULT_PORT)):
+        if isinstance(address, str):
+            self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        else:
+            self._socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            self._socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._socket.connect(address)
+        self._file = self._socket.makefile("rb")
+        self._ids = itertools.count()
+
+    def call(self, op: str, *args):
+        return self.pipeline([(op, *args)])[0]
+
+    def pipeline(self, calls) -> list: # [(операция, аргументы...)] -> результаты по порядку
+        # все запросы уходят одной отправкой, ответы читаются следом; ошибка - исключение
+        # по первому неудачному запросу (остальные ответы при этом всё равно прочитаны)
+        ids = []
+        frames = []
+        for op, *args in calls:
+            ids.append(next(self._ids))
+            frames.append(pack([ids[-1], op, args]))
+        self._socket.sendall(b"".join(frames))
+        replies = []
+        for _ in ids:
+            reply = recv_message(self._file)
+            if reply is None:
+                raise ConnectionError("Сервер закрыл соединение.")
+            replies.append(reply)
+        return [_result(reply) for reply in replies]
+
+    def search(self, field: str, value: str) -> list:
+        return self.call("search", field, value)
+
+    def search_text(self, field: str, text: str, mode: str = "prefix") -> list:
+        return self.call("search_text", field, text, mode)
+
+    def query(self, expr) -> list:
+        return self.call("query", expr)
+
+    def insert(self, record: dict):
+        return self.call("insert", record)
+
+    def update(self, record: dict):
+        return self.call("update", record)
+
+    def delete(self, field: str, value: str) -> list:
+        return self.call("delete", field, value)
+
+    def count(self) -> int:
+        return self.call("count")
+
+    def close(self):
+        self._file.close()
+        self._socket.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class AsyncClient: # asyncio-клиент: запросы из разных задач идут по одному соединению без ожидания ответов
+    def __init__(self):
+        self._reader = None
+        self._writer = None
+        self._waiting = {}  # id запроса -> future ответа
+        self._ids = itertools.count()
+        self._receiver = None
+
+    @classmethod
+    async def connect(cls, address=("127.0.0.1", DEFAULT_PORT)):
+        client = cls()
+        if isinstance(address, str):
+            client._reader, client._writer = await asyncio.open_unix_connection(address)
+        else:
+            client._reader, client._writer = await asyncio.open_connection(*address)
+        client._receiver = asyncio.create_task(client._receive())
+        return client
+
+    async def _receive(self):
+        try:
+            while True:
+                reply = await read_message(self._reader)
+                if reply is None:
+                    break
+                future = self._waiting.pop(reply[0], None)
+                if future is not None and not future.done():
+                    future.set_result(reply)
+        finally:
+            for future in self._waiting.values():
+                if not future.done():
+                    future.set_exception(ConnectionError("Сервер закрыл соединение."))
+            self._waiting.clear()
+
+    async def call(self, op: str, *args):
+        request_id = next(self._ids)
+        future = asyncio.get_running_loop().create_future()
+        self._waiting[request_id] = future
+        self._writer.write(pack([request_id, op, list(args)]))
+        await self._writer.drain()
+        return _result(await future)
+
+    async def search(self, field: str, value: str) -> list:
+        return await self.call("search", field, value)
+
+    async def query(self, expr) -> list:
+        return await self.call("query", expr)
+
+    async def insert(self, record: dict):
+        return await self.call("insert", record)
+
+    async def update(self, record: dict):
+        return await self.call("update", record)
+
+    async def delete(self, field: str, value: str) -> list:
+        return await self.call("delete", field, value)
+
+    async def close(self):
+        self._writer.close()
+        await self._writer.wait_closed()
+        if self._receiver is not None:
+            await self._receiver
@@ -0,0 +1,127 @@
+import csv
+import os
+import threading
+
+from storage import FIELDS
+
+try:
+    from openpyxl.workbook import Workbook
+except ImportError:
+    Workbook = None
+
+FORMATS = (".xlsx", ".csv", ".tsv")
+PROGRESS_EVERY = 1000  # записей между сообщениями о ходе выгрузки и проверками отмены
+
+# Выгрузка идёт потоком: записи читаются из файла данных по одной (удалённые
+# отбрасываются по сырым байтам, не разбираясь), xlsx пишется в режиме write-only
+# openpyxl, csv/tsv - обычным csv.writer, так что память не зависит от размера таблицы.
+# Результат пишется во временный файл рядом и подменяет целевой только в конце:
+# при отмене или ошибке прежний файл остаётся нетронутым.
+
+
+class _Cancelled(Exception):
+    pass
+
+
+def _rows(db, progress, cancelled): # живые записи до конца файла на момент начала выгрузки
+    with db.lock.read():
+        end = db.storage.end()  # записи, дописанные во время выгрузки, в неё не попадают
+    for count, (offset, fields) in enumerate(db.iter_records(stop=end), 1):
+        if count % PROGRESS_EVERY == 0:
+            if cancelled is not None and cancelled():
+                raise _Cancelled()
+            if progress is not None:
+                progress(offset / end if end else 1.0)
+        yield fields
+
+
+def _write_xlsx(file_path: str, rows) -> int:
+    if Workbook is None:
+        raise ValueError("Для выгрузки в .xlsx нужен пакет openpyxl.")
+    workbook = Workbook(write_only=True)  # строки сразу уходят во временный XML, а не в память
+    sheet = workbook.create_sheet()
+    sheet.append(FIELDS)
+    count = 0
+    for row in rows:
+        sheet.append(row)
+        count += 1
+    workbook.save(file_path)
+    return count
+
+
+def _write_text(file_path: str, rows, delimiter: str) -> int:
+    count = 0
+    with open(file_path, "w", newline="") as file:
+        writer = csv.writer(file, delimiter=delimiter)
+        writer.writerow(FIELDS)
+        for row in rows:
+            writer.writerow(row)
+            count += 1
+    return count
+
+
+def export(db, file_path: str, progress=None, cancelled=None): # выгрузка таблицы, формат - по расширению
+    # progress(доля 0..1) - ход выгрузки, cancelled() -> True - прервать;
+    # возвращает число выгруженных записей или None, если выгрузку отменили
+    extension = os.path.splitext(file_path)[1].lower()
+    if extension not in FORMATS:
+        raise ValueError(f"Неизвестный формат выгрузки: {extension or file_path}")
+    tmp_path = file_path + ".part"
+    rows = _rows(db, progress, cancelled)
+    try:
+        with db.streaming():  # пока идёт выгрузка, фоновое сжатие не подменит файл данных
+            if extension == ".xlsx":
+                count = _write_xlsx(tmp_path, rows)
+            else:
+                count = _write_text(tmp_path, rows, "\t" if extension == ".tsv" else ",")
+    except _Cancelled:
+        count = None
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    if count is None:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        return None
+    os.replace(tmp_path, file_path)
+    if progress is not None:
+        progress(1.0)
+    return count
+
+
+class ExportJob: # выгрузка в фоновом потоке: интерфейс опрашивает progress/done() и может вызвать cancel()
+    def __init__(self, db, file_path: str):
+        self.db = db
+        self.file_path = file_path
+        self.progress = 0.0
+        self.count = None  # число выгруженных записей, когда выгрузка завершилась
+        self.error = None  # исключение, если выгрузка не удалась
+        self._cancel = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="export", daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def _run(self):
+        try:
+            self.count = export(self.db, self.file_path, self._report, self._cancel.is_set)
+        except Exception as e:
+            self.error = e
+
+    def _report(self, share: float):
+        self.progress = share
+
+    def cancel(self):
+        self._cancel.set()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancel.is_set() and self.count is None and self.error is None
+
+    def done(self) -> bool:
+        return self._thread.ident is not None and not self._thread.is_alive()
+
+    def wait(self, timeout: float = None):
+        self._thread.join(timeout)
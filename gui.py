@@ -1,14 +1,22 @@
-import csv
 import os
-import shutil
 import tkinter as tk
-from tkinter import messagebox
+from collections import deque
+from tkinter import messagebox, simpledialog
 
-from openpyxl.workbook import Workbook
 from tkcalendar import DateEntry
 from tkinter import ttk
 from tkinter import filedialog
 
+from backup import backup as make_backup, backup_dir, list_backups, restore as restore_backup
+from bd import _legacy_path, service_files
+from export import ExportJob
+
+PAGE_SIZE = 100  # строк таблицы на одной странице
+STATS_REFRESH_MS = 1000  # период обновления окна статистики
+EXPORT_POLL_MS = 100  # период опроса фоновой выгрузки
+COMPACTION_POLL_MS = 200  # период опроса фонового сжатия
+PROFILED_OPS = ("insert", "insert_many", "search", "query", "update", "delete", "save_indices")
+
 
 class mygui:
     def __init__(self, root, db):
@@ -18,6 +26,11 @@ class mygui:
 
         self.root.protocol("WM_DELETE_WINDOW", self.on_closing)
 
+        self.page_starts = [0]  # адреса начала просмотренных страниц (для "назад")
+        self.next_start = None  # адрес начала следующей страницы
+        self.search_mode = False  # в таблице результаты поиска, а не страница БД
+        self.compaction = None  # фоновое сжатие, окончания которого ждёт таблица
+
         self.create_widgets()
 
     def create_widgets(self):
@@ -41,7 +54,7 @@ class mygui:
         self.load_button = tk.Button(self.root, text="Load from backup", command=self.load_from_backup)
         self.load_button.grid(row=2, column=3)
 
-        self.import_button = tk.Button(self.root, text="Export to .xlsx", command=self.import_)
+        self.import_button = tk.Button(self.root, text="Export", command=self.import_)
         self.import_button.grid(row=0, column=3)
 
         self.create_button = tk.Button(self.root, text="Create data base", command=self.create)
@@ -53,6 +66,10 @@ class mygui:
         self.deldb_button = tk.Button(self.root, text="DELETE DATA BASE", command=self.deldb)
         self.deldb_button.grid(row=14, column=3)
 
+        self.stats_button = tk.Button(self.root, text="Stats", command=self.show_stats)
+        self.stats_button.grid(row=2, column=2)
+        self.stats_panel = None
+
 
         # поля для ввода
         self.sn_label = tk.Label(self.root, text="SN:")
@@ -102,6 +119,12 @@ class mygui:
         self.key_entry = tk.Entry(self.root)
         self.key_entry.grid(row=8, column=2)
 
+        # режим сравнения: точное совпадение или часть значения (только Name)
+        self.match_var = tk.StringVar(self.root)
+        self.match_var.set("equals")
+        self.match_option = tk.OptionMenu(self.root, self.match_var, "equals", "starts with", "contains")
+        self.match_option.grid(row=8, column=3)
+
         self.search_button = tk.Button(self.root, text="Search", command=self.search_record)
         self.search_button.grid(row=9, column=0, columnspan=2)
 
@@ -126,6 +149,20 @@ class mygui:
         self.tree.column("Sold", width=50, anchor="center")
         self.tree.column("Compliance Index", width=150, anchor="center")
 
+        # постраничный просмотр: в таблице только видимое окно записей
+        self.page_label = tk.Label(self.root, text="")
+        self.page_label.grid(row=12, column=0, columnspan=3)
+
+        self.prev_button = tk.Button(self.root, text="<< Prev", command=self.prev_page)
+        self.prev_button.grid(row=14, column=0)
+
+        self.next_button = tk.Button(self.root, text="Next >>", command=self.next_page)
+        self.next_button.grid(row=14, column=2)
+
+    def show_stats(self): # окно статистики (одно на приложение)
+        if self.stats_panel is None or self.stats_panel.closed:
+            self.stats_panel = StatsPanel(self.root, self.db)
+
     def validate_sn(self, value):
 
         if value == "":
@@ -184,8 +221,10 @@ class mygui:
             "Compliance Index": cid,
             "Sold": sold,
         }
-        self.db.insert(record) # добавление
-        self.print() # печать таблицы
+        offset = self.db.insert(record) # добавление
+        if offset is not None:
+            self.refresh_inserted(offset) # обновление видимой страницы
+        self.watch_compaction()
 
        # self.sn_entry.delete(0, tk.END)
        # self.name_entry.delete(0, tk.END)
@@ -228,8 +267,9 @@ class mygui:
             "Compliance Index": cid,
             "Sold": sold,
         }
-        self.db.update(record) # обновление записи
-        self.print()
+        offset = self.db.update(record) # обновление записи
+        self.refresh_updated(record, offset)
+        self.watch_compaction()
 
 
        # self.sn_entry.delete(0, tk.END)
@@ -256,9 +296,16 @@ class mygui:
             messagebox.showerror("Error", "Введите что-нибудь!")
             return
         search = self.search_var.get()
+        match = self.match_var.get()
         #print(key)
         # поиск записей
-        results = self.db.search(search, str(key))
+        if match == "equals":
+            results = self.db.search(search, str(key))
+        elif search != "Name":
+            messagebox.showerror("Error", "Поиск по началу или части значения есть только для поля Name!")
+            return
+        else:
+            results = self.db.search_text(search, str(key), "prefix" if match == "starts with" else "contains")
 
         #
         #self.results_text.delete(1.0, tk.END)
@@ -271,6 +318,8 @@ class mygui:
         # очистка старой таблицы
         for row in self.tree.get_children():
             self.tree.delete(row)
+        self.search_mode = True
+        self.page_label.config(text=f"Найдено записей: {len(results)}")
 
         # добавляем новые
         if len(results) != 0:
@@ -280,24 +329,68 @@ class mygui:
 
 
 
-    def print(self):
+    def print(self): # первая страница таблицы
             if self.db.file_path is None:
                 messagebox.showerror("Error", "База данных не открыта!")
                 return
+            self.page_starts = [0]
+            self.show_page()
+
+    def show_page(self): # перечитывает из бд только текущее окно записей
+            self.search_mode = False
             # очистка
             for row in self.tree.get_children():
                 self.tree.delete(row)
 
-            # получаем из бд
-            records = self.db._load_data()
-            print(records)
-            # выводим (добавляем в таблицу)
-            if len(records) != 0:
-                for record in records:
-                    if len(record)==5:
-                        self.tree.insert("", "end", values=(
+            rows, self.next_start = self.db.page(self.page_starts[-1], PAGE_SIZE)
+            # выводим (добавляем в таблицу), строка таблицы = адрес записи
+            for offset, record in rows:
+                self.tree.insert("", "end", iid=str(offset), values=(
                  record[0], record[1], record[2], record[3], record[4]))
 
+            self.update_page_label()
+            self.prev_button.config(state=tk.NORMAL if len(self.page_starts) > 1 else tk.DISABLED)
+            self.next_button.config(state=tk.NORMAL if self.next_start is not None else tk.DISABLED)
+
+    def update_page_label(self):
+        first = (len(self.page_starts) - 1) * PAGE_SIZE
+        shown = len(self.tree.get_children())
+        self.page_label.config(text=f"Записи {first + 1 if shown else 0}-{first + shown} из {self.db.count()}")
+
+    def next_page(self):
+        if self.db.file_path is None or self.search_mode or self.next_start is None:
+            return
+        self.page_starts.append(self.next_start)
+        self.show_page()
+
+    def prev_page(self):
+        if self.db.file_path is None or self.search_mode or len(self.page_starts) < 2:
+            return
+        self.page_starts.pop()
+        self.show_page()
+
+    def refresh_inserted(self, offset): # новая запись видна, только если попала в текущее окно
+        if self.search_mode:
+            self.print()
+        elif offset >= self.page_starts[-1] and (self.next_start is None or offset < self.next_start):
+            self.show_page()
+        else:
+            self.update_page_label()
+
+    def refresh_updated(self, record, offset): # правится только строка обновлённой записи
+        if self.search_mode:
+            self.print()
+            return
+        for iid in self.tree.get_children():
+            if self.tree.set(iid, "SN") == record["SN"]:
+                if iid == str(offset):
+                    self.tree.item(iid, values=(
+                        record["SN"], record["Name"], record["Date"], record["Compliance Index"], record["Sold"]))
+                else:
+                    self.show_page()  # запись переехала на другой адрес
+                return
+        self.refresh_inserted(offset)
+
     def delete_record(self):
         if self.db.file_path is None:
             messagebox.showerror("Error", "База данных не открыта!")
@@ -311,10 +404,18 @@ class mygui:
         search = self.search_var.get()
 
         # удаление
-        self.db.delete(search, str(key))
+        deleted = self.db.delete(search, str(key))
         #self.results_text.delete(1.0, tk.END)
 
-        self.print()
+        if self.search_mode:
+            self.print()
+            return
+        # убираем из таблицы только удалённые строки
+        for offset in deleted:
+            if self.tree.exists(str(offset)):
+                self.tree.delete(str(offset))
+        self.update_page_label()
+        self.watch_compaction()
 
 
     def hard_erase(self):       # убирает удалённые записи из файлов
@@ -322,51 +423,32 @@ class mygui:
                 messagebox.showerror("Error", "База данных не открыта!")
                 return
 
-            records = self.db._load_data()
-
-            # список без удаленных строк
-            updated_records = []
-
-            for record in records:
-                if record[0] != "------":
-                    if '+' in record[4]:
-                        record[4] = '+'
-                    if '-' in record[4]:
-                        record[4] = '-'
-                    # строки с "------" в поле SN считаются удалёнными
-                    updated_records.append(record)
-
-            print(updated_records)
-            self.db.indicesSN = {}
-            self.db.indicesNAME = {}
-            self.db.indicesDATE = {}
-            self.db.indicesIND = {}
-            self.db.indicesSOLD = {}
-
-            with open(self.db.file_path, "w", newline="") as file:
-                for row in updated_records:
-                    print(row)
-                    writer = csv.writer(file)
-                    # получаем смещение
-                    offset = file.tell()
-                    writer.writerow(row)
-                    if row[0] not in self.db.indicesSN:
-                        self.db.indicesSN[row[0]] = []
-                    self.db.indicesSN[row[0]].append(offset)
-
-                    if row[1] not in self.db.indicesNAME:
-                        self.db.indicesNAME[row[1]] = []
-                    self.db.indicesNAME[row[1]].append(offset)
-                    if row[2] not in self.db.indicesDATE:
-                        self.db.indicesDATE[row[2]] = []
-                    self.db.indicesDATE[row[2]].append(offset)
-                    if row[3] not in self.db.indicesIND:
-                        self.db.indicesIND[row[3]] = []
-                    self.db.indicesIND[row[3]].append(offset)
-                    if row[4] not in self.db.indicesSOLD:
-                        self.db.indicesSOLD[row[4]] = []
-                    self.db.indicesSOLD[row[4]].append(offset)
-            self.db.removed = []
+            # живые записи по частям переносятся в новый файл в фоне, таблица работает как обычно;
+            # когда файл подменён, адреса строк поменялись - страница перечитывается
+            compaction = self.db.compact_background()
+            if compaction is None:
+                messagebox.showinfo("Info", "Идёт выгрузка таблицы: сжатие можно запустить после её окончания.")
+                return
+            self.erase_button.config(state=tk.DISABLED)
+            if compaction is not self.compaction:  # уже идущее сжатие таблица и так ждёт
+                self.wait_compaction(compaction)
+
+    def watch_compaction(self): # сжатие, запущенное базой само (удалённых стало много), ждём так же, как "Hard erase"
+        compaction = self.db.compaction
+        if compaction is not None and compaction is not self.compaction:
+            self.erase_button.config(state=tk.DISABLED)
+            self.wait_compaction(compaction)
+
+    def wait_compaction(self, compaction):
+        self.compaction = compaction
+        if not compaction.done():
+            self.root.after(COMPACTION_POLL_MS, self.wait_compaction, compaction)
+            return
+        self.erase_button.config(state=tk.NORMAL)
+        if compaction.error is not None:
+            messagebox.showerror("Error", f"Ошибка при сжатии базы: {compaction.error}")
+        elif compaction.swapped:
+            self.print()
             print("Все удалённые записи перезаписаны, и хэш-таблицы пересозданы.")
 
 
@@ -374,153 +456,62 @@ class mygui:
         if self.db.file_path is None:
             messagebox.showerror("Error", "База данных не открыта!")
             return
-        with open(self.db.file_path, "w") as file:
-            pass
-        with open(self.db.index_files["SN"], "w") as file:
-            pass
-        with open(self.db.index_files["Name"], "w") as file:
-            pass
-        with open(self.db.index_files["Date"], "w") as file:
-            pass
-        with open(self.db.index_files["Compliance Index"], "w") as file:
-            pass
-        with open(self.db.index_files["Sold"], "w") as file:
-            pass
-        with open(self.db.index_files["Removed"], "w") as file:
-            pass
-
-        self.db.indicesSN = {}
-        self.db.indicesNAME = {}
-        self.db.indicesDATE = {}
-        self.db.indicesIND = {}
-        self.db.indicesSOLD = {}
-        self.db.removed = []
+        self.db.clear()  # под блокировкой записи, идущее фоновое сжатие бросается
 
         self.print()
 
-    def backup(self):
+    def backup(self): # разностная копия (первая - полная) в директории backups рядом с базой
         if self.db.file_path is None:
             messagebox.showerror("Error", "База данных не открыта!")
             return
 
         try:
-            self.db.save_indices()
-            db_directory = os.path.dirname(self.db.file_path)
-            backup_db_path = os.path.join(db_directory, "backup_database.csv")
-            shutil.copy(self.db.file_path, backup_db_path)
-            for index_name, index_path in self.db.index_files.items():
-                index_backup_path = os.path.join(db_directory, f"backup_{os.path.basename(index_path)}")
-                shutil.copy(index_path, index_backup_path)
-
-            messagebox.showinfo("Info", "База данных и индексные файлы сохранены в директории базы данных.")
+            manifest = make_backup(self.db)
+            kind = "полная" if manifest["base"] == manifest["number"] else f"разностная к копии {manifest['base']}"
+            messagebox.showinfo("Info", f"Резервная копия {manifest['number']} ({kind}) сохранена в "
+                                        f"{backup_dir(self.db)}, записано байт: {manifest['stored_bytes']}.")
         except Exception as e:
             messagebox.showerror("Error", f"Ошибка при создании резервной копии: {e}")
 
-    def load_from_backup(self):
+    def load_from_backup(self): # возврат к любой из копий, по умолчанию к последней
         if self.db.file_path is None:
             messagebox.showerror("Error", "База данных не открыта!")
             return
 
+        numbers = [manifest["number"] for manifest in list_backups(backup_dir(self.db))]
+        if not numbers:
+            messagebox.showerror("Error", "Резервная копия базы данных не найдена!")
+            return
+        number = simpledialog.askinteger("Load from backup", f"Номер резервной копии ({numbers[0]}-{numbers[-1]}):",
+                                         initialvalue=numbers[-1], minvalue=numbers[0], maxvalue=numbers[-1])
+        if number is None:
+            return
         try:
-            self.db.save_indices()
-            db_directory = os.path.dirname(self.db.file_path)
-            backup_db_path = os.path.join(db_directory, "backup_database.csv")
-            if os.path.exists(backup_db_path):
-                shutil.copy(backup_db_path, self.db.file_path)
-            else:
-                messagebox.showerror("Error", "Резервная копия базы данных не найдена!")
-                return
-
-            indexes = {
-                "SN": "backup_index_sn.csv",
-                "Name": "backup_index_name.csv",
-                "Date": "backup_index_date.csv",
-                "Compliance Index": "backup_index_compliance_index.csv",
-                "Sold": "backup_index_sold.csv",
-                "Removed" : "backup_removed.txt",
-            }
-
-            for i in indexes.values():
-                full_path = os.path.join(db_directory, i)
-                full_path = full_path.replace("/", "\\")
-                if os.path.exists(full_path):
-                    if i == "backup_index_sn.csv":
-                        self.db.indicesSN = {}
-                        self.db.indicesSN = self.db.load_index(full_path)
-                        print("SN hash table updated")
-                    if i == "backup_index_name.csv":
-                        self.db.indicesNAME = {}
-                        self.db.indicesNAME = self.db.load_index(full_path)
-                        print("name hash table updated")
-                    if i == "backup_index_date.csv":
-                        self.db.indicesDATE = {}
-                        self.db.indicesDATE = self.db.load_index(full_path)
-                        print("date hash table updated")
-                    if i == "backup_index_compliance_index.csv":
-                        self.db.indicesIND = {}
-                        self.db.indicesIND = self.db.load_index(full_path)
-                        print("ind hash table updated")
-                    if i == "backup_index_sold.csv":
-                        self.db.indicesSOLD = {}
-                        self.db.indicesSOLD = self.db.load_index(full_path)
-                        print("sold hash table updated")
-                    if i == "backup_removed.txt":
-                        self.db.removed = []
-                        self.db.removed = self.db.load_removed(full_path)
-                        self.db.removed_path = full_path
-                        print("removed hash table updated")
-                else:
-                    print(full_path)
-                    messagebox.showerror("Error", "Резервная копия файла удалённых элементов не найдена!")
-                    return
-            messagebox.showinfo("Info", "Таблица и служебные файлы загружены из backup.")
-            print(self.db.indicesSN)
+            restore_backup(self.db, number)
+            messagebox.showinfo("Info", f"Таблица и служебные файлы загружены из резервной копии {number}.")
             self.print()
         except Exception as e:
             messagebox.showerror("Error", f"Ошибка при загрузке из резервной копии: {e}")
 
 
-    def import_(self):
+    def import_(self): # выгрузка идёт в фоне, окно с ходом выгрузки можно закрыть кнопкой отмены
         if self.db.file_path is None:
             messagebox.showerror("Error", "База данных не открыта!")
             return
 
-        rows = self.db._load_data()
-
-        # новый список строк без удалённых
-        updated_rows = []
-
-
-        for idx, row in enumerate(rows):
-            if row[0] != "------":
-                updated_rows.append(row)
-
-        workbook = Workbook()
-        sheet = workbook.active  # активный лист
-
-        # заголовки
-        sheet.append(["SN", "Name", "Date", "Compliance Index", "Sold"])
-
-        for row in updated_rows:
-            sheet.append(row)
-
         file_path = filedialog.asksaveasfilename(defaultextension=".xlsx",
-                                                 filetypes=[("Excel files", "*.xlsx"), ("All files", "*.*")],
+                                                 filetypes=[("Excel files", "*.xlsx"), ("CSV files", "*.csv"),
+                                                            ("TSV files", "*.tsv"), ("All files", "*.*")],
                                                  title="Сохранить файл как")
-
-        if file_path:
-            try:
-                workbook.save(file_path)
-                messagebox.showinfo("Info", f"Файл успешно сохранён: {file_path}")
-            except Exception as e:
-                messagebox.showerror("Error", f"Ошибка при сохранении файла: {e}")
-        else:
+        if not file_path:
             messagebox.showwarning("Warning", "Сохранение файла отменено.")
+            return
+        ExportWindow(self.root, ExportJob(self.db, file_path).start())
 
     def create(self):
         file_path = filedialog.asksaveasfilename(
             title="Создайте новый файл базы данных",
-            filetypes=(("Файлы .csv", "*.csv"), ("Все файлы", "*.*")),
+            filetypes=(("Файлы .csv", "*.csv"), ("Двоичные файлы .mydb", "*.mydb"), ("Все файлы", "*.*")),
             defaultextension=".csv"
         )
 
@@ -532,8 +523,8 @@ class mygui:
             "SN": "index_sn.csv",
             "Name": "index_name.csv",
             "Date": "index_date.csv",
-            "Compliance Index": "index_compliance_index.csv",
-            "Sold": "index_sold.csv",
+            "Compliance Index": "index_compliance_index.bm",
+            "Sold": "index_sold.bm",
             "Removed": "removed.txt"
         }
 
@@ -541,17 +532,13 @@ class mygui:
 
         for file_name in index_files.values():
             file_path_in_directory = os.path.join(directory, file_name)
-            if os.path.exists(file_path_in_directory):
+            legacy = _legacy_path(file_path_in_directory)
+            if os.path.exists(file_path_in_directory) or (legacy is not None and os.path.exists(legacy)):
                 messagebox.showerror("Error",
                                      f"Файл {file_name} уже существует в директории {directory}. Удалите файлы или выберите другую директорию.")
                 return
 
 
-        # НОВЫЙ ФАЙЛ БД
-        with open(file_path, "w", newline="") as file:
-            writer = csv.writer(file)
-            writer.writerow(["SN", "Name", "Date", "Compliance Index", "Sold"])  # Заголовки таблицы
-
         # пустые файлы индексов
         for file in index_files.values():
             with open(file, "w") as f:
@@ -563,22 +550,24 @@ class mygui:
             with open(file_path_in_directory, "w") as f:
                 pass
 
-        self.db.file_path = file_path
-        self.db.indicesSN = {}
-        self.db.indicesNAME = {}
-        self.db.indicesDATE = {}
-        self.db.indicesIND = {}
-        self.db.indicesSOLD = {}
-        self.db.removed = []
-        self.db.index_files = {key: os.path.join(directory, file) for key, file in index_files.items()}
-        self.db.removed_path = self.db.index_files["Removed"]
+        index_files = {key: os.path.join(directory, file) for key, file in index_files.items()}
+
+        # журнал от прежней базы в этой директории не должен попасть в новую
+        for path in service_files(index_files):
+            if os.path.exists(path):
+                os.remove(path)
+
+        # НОВЫЙ ФАЙЛ БД (формат выбирается по расширению: .csv или .mydb)
+        if os.path.exists(file_path):
+            os.remove(file_path)
+        self.db.reopen(file_path, index_files)
 
         messagebox.showinfo("Info", f"Новая база данных создана: {file_path}")
 
     def open(self):
         file_path = filedialog.askopenfilename(
             title="Открыть базу данных",
-            filetypes=(("CSV files", "*.csv"), ("All files", "*.*"))
+            filetypes=(("CSV files", "*.csv"), ("mydb files", "*.mydb"), ("All files", "*.*"))
         )
         if not file_path:
             return
@@ -586,9 +575,7 @@ class mygui:
         db_path = os.path.dirname(file_path)
 
         # восстанавливаем базу данных из резервной копии
-        if os.path.exists(file_path):
-            self.db.file_path = file_path
-        else:
+        if not os.path.exists(file_path):
             messagebox.showerror("Error", "База данных не найдена!")
             return
 
@@ -596,53 +583,24 @@ class mygui:
             "SN": "index_sn.csv",
             "Name": "index_name.csv",
             "Date": "index_date.csv",
-            "Compliance Index": "index_compliance_index.csv",
-            "Sold": "index_sold.csv",
+            "Compliance Index": "index_compliance_index.bm",
+            "Sold": "index_sold.bm",
             "Removed": "removed.txt",
         }
         index_files = {}
-        for i in indexes.values():
+        for field, i in indexes.items():
             full_path = os.path.join(db_path, i)
             full_path = full_path.replace("/", "\\")
-            if os.path.exists(full_path):
-                if i == "index_sn.csv":
-                    self.db.indicesSN = {}
-                    self.db.indicesSN = self.db.load_index(full_path)
-                    index_files["SN"] = full_path
-                    print("SN hash table updated")
-                if i == "index_name.csv":
-                    self.db.indicesNAME = {}
-                    self.db.indicesNAME = self.db.load_index(full_path)
-                    print("name hash table updated")
-                    index_files["Name"] = full_path
-                if i == "index_date.csv":
-                    self.db.indicesDATE = {}
-                    self.db.indicesDATE = self.db.load_index(full_path)
-                    index_files["Date"] = full_path
-                    print("date hash table updated")
-                if i == "index_compliance_index.csv":
-                    self.db.indicesIND = {}
-                    self.db.indicesIND = self.db.load_index(full_path)
-                    index_files["Compliance Index"] = full_path
-                    print("ind hash table updated")
-                if i == "index_sold.csv":
-                    self.db.indicesSOLD = {}
-                    self.db.indicesSOLD = self.db.load_index(full_path)
-                    index_files["Sold"] = full_path
-                    print("sold hash table updated")
-                if i == "removed.txt":
-                    self.db.removed = []
-                    self.db.removed = self.db.load_removed(full_path)
-                    self.db.removed_path = full_path
-                    index_files["Removed"] = full_path
-                    print("removed hash table updated")
+            legacy = _legacy_path(full_path)  # база, сохранённая до переименования файлов битовых карт
+            if os.path.exists(full_path) or (legacy is not None and os.path.exists(legacy)):
+                index_files[field] = full_path
             else:
                 print(full_path)
                 messagebox.showerror("Error", "Ошибка нахождения служебных файлов!")
                 return
+        # загрузка хэш-таблиц и открытие файла данных
+        self.db.reopen(file_path, index_files)
         messagebox.showinfo("Info", "Таблица и служебные файлы загружены.")
-        self.db.index_files = index_files
-        self.db.removed_path = index_files["Removed"]
         self.print()
 
 
@@ -651,12 +609,138 @@ class mygui:
         if self.db.file_path is None:
             messagebox.showerror("Error", "База данных не открыта!")
             return
+        self.db.close()
         os.remove(self.db.file_path)  # удаляет файл
 
         for i in self.db.index_files.values():
-            os.remove(i)
+            for path in (i, _legacy_path(i)):
+                if path is not None and os.path.exists(path):
+                    os.remove(path)
+        for i in service_files(self.db.index_files):
+            if os.path.exists(i):
+                os.remove(i)
         self.db.file_path = None
+        self.page_label.config(text="")
         messagebox.showinfo("Info", "Таблица удалена.")
 #        self.db = None
         self.tree.delete(*self.tree.get_children())  # очистка таблицы в окошке
 
+
+class StatsPanel: # живая статистика mydb: приёмник событий метрик + периодическое обновление
+    def __init__(self, root, db):
+        self.db = db
+        self.closed = False
+        self.recent = deque(maxlen=15)  # последние операции
+        self.last_profile = None
+
+        self.window = tk.Toplevel(root)
+        self.window.title("mydb stats")
+        self.window.protocol("WM_DELETE_WINDOW", self.close)
+
+        self.text = tk.Text(self.window, width=100, height=40)
+        self.text.grid(row=0, column=0, columnspan=2)
+
+        self.profile_var = tk.BooleanVar(self.window, value=False)
+        self.profile_check = tk.Checkbutton(self.window, text="cProfile", variable=self.profile_var,
+                                            command=self.toggle_profile)
+        self.profile_check.grid(row=1, column=0)
+
+        self.reset_button = tk.Button(self.window, text="Reset", command=self.reset)
+        self.reset_button.grid(row=1, column=1)
+
+        # пока окно открыто, метрики включены
+        self.was_enabled = db.metrics.enabled
+        db.metrics.enabled = True
+        db.metrics.add_sink(self)
+        self.after_id = None
+        self.refresh()
+
+    def emit(self, event): # вызывается метриками после каждой операции
+        if event["event"] == "profile":
+            self.last_profile = event
+        else:
+            self.recent.append(event)
+
+    def toggle_profile(self):
+        self.db.metrics.profiled = set(PROFILED_OPS) if self.profile_var.get() else set()
+
+    def reset(self):
+        self.db.metrics.reset()
+        self.recent.clear()
+        self.last_profile = None
+        self.render()
+
+    def render(self):
+        snapshot = self.db.metrics.snapshot()
+        lines = ["Счётчики:"]
+        for name, value in sorted(snapshot["counters"].items()):
+            lines.append(f"  {name:<20} {value}")
+        for name, value in sorted(snapshot["ratios"].items()):
+            lines.append(f"  {name:<20} {value:.1%}")
+        lines.append("")
+        lines.append(f"  {'операция':<14}{'вызовов':>9}{'p50 мс':>10}{'p95 мс':>10}{'p99 мс':>10}{'макс мс':>10}")
+        for op, stats in sorted(snapshot["latency"].items()):
+            lines.append(f"  {op:<14}{stats['count']:>9}{stats['p50_ms']:>10}{stats['p95_ms']:>10}"
+                         f"{stats['p99_ms']:>10}{stats['max_ms']:>10}")
+        lines.append("")
+        lines.append("Последние операции:")
+        for event in reversed(self.recent):
+            lines.append(f"  {event['op']:<14}{event['ms']:>10} мс")
+        if self.last_profile is not None:
+            lines.append("")
+            lines.append(f"Профиль {self.last_profile['label']} ({self.last_profile['ms']} мс):")
+            lines.extend(self.last_profile["profile"].splitlines()[:30])
+        self.text.delete("1.0", tk.END)
+        self.text.insert(tk.END, "\n".join(lines))
+
+    def refresh(self):
+        if self.closed:
+            return
+        self.render()
+        self.after_id = self.window.after(STATS_REFRESH_MS, self.refresh)
+
+    def close(self):
+        self.closed = True
+        if self.after_id is not None:
+            self.window.after_cancel(self.after_id)
+        self.db.metrics.remove_sink(self)
+        self.db.metrics.profiled = set()
+        self.db.metrics.enabled = self.was_enabled
+        self.window.destroy()
+
+
+class ExportWindow: # ход фоновой выгрузки: полоса прогресса и отмена, итог - сообщением
+    def __init__(self, root, job):
+        self.job = job
+
+        self.window = tk.Toplevel(root)
+        self.window.title("Export")
+        self.window.protocol("WM_DELETE_WINDOW", self.cancel)
+
+        self.label = tk.Label(self.window, text=f"Выгрузка в {job.file_path}")
+        self.label.grid(row=0, column=0)
+
+        self.progress = ttk.Progressbar(self.window, length=300, maximum=1.0)
+        self.progress.grid(row=1, column=0)
+
+        self.cancel_button = tk.Button(self.window, text="Cancel", command=self.cancel)
+        self.cancel_button.grid(row=2, column=0)
+
+        self.poll()
+
+    def poll(self):
+        if not self.job.done():
+            self.progress["value"] = self.job.progress
+            self.window.after(EXPORT_POLL_MS, self.poll)
+            return
+        self.window.destroy()
+        if self.job.error is not None:
+            messagebox.showerror("Error", f"Ошибка при сохранении файла: {self.job.error}")
+        elif self.job.count is None:
+            messagebox.showwarning("Warning", "Выгрузка отменена.")
+        else:
+            messagebox.showinfo("Info", f"Файл успешно сохранён: {self.job.file_path} ({self.job.count} записей)")
+
+    def cancel(self): # окно закроется при следующем опросе, когда поток выгрузки остановится
+        self.job.cancel()
+        self.cancel_button.config(state=tk.DISABLED)
@@ -0,0 +1,537 @@
+import bisect
+import struct
+from array import array
+
+
+# Неразборчивое значение из файла уходит в начало порядка, а та же ошибка в границе
+# диапазона из запроса (strict) - ValueError: иначе граница молча стала бы "от минимума".
+
+
+def date_key(value: str, strict: bool = False): # ДД/ММ/ГГГГ -> (ГГГГ, ММ, ДД), чтобы даты шли по времени, а не по строке
+    try:
+        day, month, year = value.split("/")
+        return int(year), int(month), int(day)
+    except ValueError:
+        if strict:
+            raise ValueError(f"Неверная дата {value!r}: ожидается ДД/ММ/ГГГГ.") from None
+        return 0, 0, 0
+
+
+def number_key(value: str, strict: bool = False): # индекс соответствия сравнивается как число
+    try:
+        number = float(value)
+    except ValueError:
+        if strict:
+            raise ValueError(f"Неверное число {value!r}.") from None
+        return float("-inf")
+    if strict and number != number:
+        raise ValueError(f"Неверное число {value!r}.")
+    return number
+
+
+class OrderedIndex(dict): # хэш-таблица + отсортированный массив ключей для поиска по диапазону
+    def __init__(self, sort_key, data=()):
+        super().__init__(data)
+        self.sort_key = sort_key
+        # ключи сохраняются в снимок уже по порядку: сортировка ниже - один линейный проход
+        if sort_key is str:
+            self._keys = sorted(self)
+            self._order = None  # ключ сортировки - сама строка, второй массив не нужен
+        else:
+            self._keys = sorted(self, key=sort_key)
+            self._order = [sort_key(key) for key in self._keys]  # ключи сортировки для bisect
+
+    def _sorted(self) -> list: # массив для bisect
+        return self._keys if self._order is None else self._order
+
+    def _position(self, key) -> int:
+        pos = bisect.bisect_left(self._sorted(), self.sort_key(key))
+        while self._keys[pos] != key:  # разные строки с одинаковым значением ("0.5" и "0.50")
+            pos += 1
+        return pos
+
+    def __setitem__(self, key, value):
+        if key not in self:
+            order = self.sort_key(key)
+            pos = bisect.bisect_right(self._sorted(), order)
+            self._keys.insert(pos, key)
+            if self._order is not None:
+                self._order.insert(pos, order)
+        super().__setitem__(key, value)
+
+    def __delitem__(self, key):
+        super().__delitem__(key)
+        pos = self._position(key)
+        del self._keys[pos]
+        if self._order is not None:
+            del self._order[pos]
+
+    def setdefault(self, key, default=None):
+        if key not in self:
+            self[key] = default
+        return self[key]
+
+    def pop(self, key, *default):
+        if key not in self:
+            return super().pop(key, *default)
+        value = self[key]
+        del self[key]
+        return value
+
+    def popitem(self):
+        key = self._keys[-1]
+        return key, self.pop(key)
+
+    def update(self, *args, **kwargs): # новые ключи вливаются в массив одним слиянием, а не вставкой по одному
+        items = dict(*args, **kwargs)
+        new = [key for key in items if key not in self]
+        super().update(items)
+        if new:
+            self._merge(new)
+
+    def _merge(self, new: list): # слияние отсортированных новых ключей с массивом: O(n + m log n)
+        if self._order is None:
+            new.sort()
+            orders = new
+        else:
+            new.sort(key=self.sort_key)
+            orders = [self.sort_key(key) for key in new]
+        current = self._sorted()
+        if not current or orders[0] >= current[-1]:  # ключи больше всех прежних - просто в конец
+            self._keys.extend(new)
+            if self._order is not None:
+                self._order.extend(orders)
+            return
+        positions = [bisect.bisect_right(current, order) for order in orders]
+        self._keys = _spliced(self._keys, positions, new)
+        if self._order is not None:
+            self._order = _spliced(self._order, positions, orders)
+
+    def clear(self):
+        super().clear()
+        self._keys = []
+        self._order = None if self.sort_key is str else []
+
+    def _bound(self, value): # граница диапазона из запроса: неразборчивая - ошибка
+        return value if self.sort_key is str else self.sort_key(value, strict=True)
+
+    def irange(self, lo: str = None, hi: str = None): # ключи lo <= key <= hi по возрастанию (None - без границы)
+        current = self._sorted()
+        start = 0 if lo is None else bisect.bisect_left(current, self._bound(lo))
+        stop = len(self._keys) if hi is None else bisect.bisect_right(current, self._bound(hi))
+        return iter(self._keys[start:stop])
+
+    def ordered(self): # все ключи по возрастанию
+        return iter(self._keys)
+
+
+def _spliced(items: list, positions: list, values: list) -> list: # values вставлены перед items[positions[i]]
+    result = []
+    start = 0
+    for pos, value in zip(positions, values):
+        result += items[start:pos]
+        result.append(value)
+        start = pos
+    result += items[start:]
+    return result
+
+
+GRAM = 3  # длина n-граммы для поиска по подстроке
+
+
+def grams_of(key: str) -> set: # n-граммы ключа; ключ короче GRAM - сам себе n-грамма
+    return {key[i:i + GRAM] for i in range(len(key) - GRAM + 1)} or {key}
+
+
+class TextIndex(OrderedIndex): # строковые ключи: поиск по началу (бинарный) и по подстроке (n-граммы)
+    def __init__(self, data=()):
+        super().__init__(str, data)
+        self.grams = None  # n-грамма -> множество ключей, строится при первом поиске по подстроке
+
+    def __setitem__(self, key, value):
+        new = key not in self
+        super().__setitem__(key, value)
+        if new and self.grams is not None:
+            for gram in grams_of(key):
+                self.grams.setdefault(gram, set()).add(key)
+
+    def _merge(self, new: list):
+        super()._merge(new)
+        if self.grams is not None:
+            for key in new:
+                for gram in grams_of(key):
+                    self.grams.setdefault(gram, set()).add(key)
+
+    def __delitem__(self, key):
+        super().__delitem__(key)
+        if self.grams is not None:
+            for gram in grams_of(key):
+                keys = self.grams.get(gram)
+                if keys is not None:
+                    keys.discard(key)
+                    if not keys:
+                        del self.grams[gram]
+
+    def clear(self):
+        super().clear()
+        self.grams = None
+
+    def build_grams(self) -> dict:
+        if self.grams is None:
+            grams = {}
+            for key in self:
+                for gram in grams_of(key):
+                    if gram in grams:
+                        grams[gram].add(key)
+                    else:
+                        grams[gram] = {key}
+            self.grams = grams
+        return self.grams
+
+    def prefix(self, text: str): # ключи, начинающиеся с text, по возрастанию
+        if not text:
+            return self.ordered()
+        return self.irange(text, text + "\uffff")
+
+    def contains(self, text: str) -> list: # ключи, содержащие text, по возрастанию
+        if not text:
+            return list(self.ordered())
+        grams = self.build_grams()
+        if len(text) >= GRAM:
+            # кандидаты - пересечение множеств всех n-грамм text, начиная с самого маленького
+            parts = sorted((grams.get(gram, set()) for gram in grams_of(text)), key=len)
+            candidates = parts[0].intersection(*parts[1:])
+        else:
+            # короткий образец входит в одну из n-грамм ключа: перебор n-грамм, а не ключей
+            candidates = set()
+            for gram, keys in grams.items():
+                if text in gram:
+                    candidates |= keys
+        return sorted(key for key in candidates if text in key and key in self)
+
+
+class Postings: # отсортированный массив адресов; удаление помечает элемент, сжатие - когда мёртвых больше половины
+    # единственный адрес (почти у каждого ключа Name) хранится числом, массив заводится со вторым
+    __slots__ = ("_items", "_dead")
+
+    def __init__(self, values=()):
+        values = sorted(values)
+        self._items = values[0] if len(values) == 1 else array("q", values)  # удалённый адрес v хранится как -v-1
+        self._dead = 0
+
+    @classmethod
+    def from_sorted(cls, items): # из готового отсортированного массива array('q'), без копирования
+        postings = cls.__new__(cls)
+        postings._items = items[0] if len(items) == 1 else items
+        postings._dead = 0
+        return postings
+
+    def _array(self): # массив адресов; одиночный адрес переводится в массив
+        items = self._items
+        if type(items) is int:
+            items = self._items = array("q", (items,))
+        return items
+
+    def __len__(self):
+        items = self._items
+        return 1 if type(items) is int else len(items) - self._dead
+
+    def __bool__(self):
+        items = self._items
+        return type(items) is int or len(items) > self._dead
+
+    def __iter__(self): # адреса по возрастанию
+        items = self._items
+        if type(items) is int:
+            return iter((items,))
+        return (value for value in items if value >= 0)
+
+    def __contains__(self, value):
+        items = self._items
+        if type(items) is int:
+            return items == value
+        pos = self._find(value)
+        return pos < len(items) and items[pos] == value
+
+    def __repr__(self):
+        return f"Postings({list(self)})"
+
+    def _find(self, value) -> int: # бинарный поиск с учётом помеченных элементов
+        items = self._items
+        lo, hi = 0, len(items)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            item = items[mid]
+            if (item if item >= 0 else -item - 1) < value:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def append(self, value: int):
+        items = self._items
+        if type(items) is int:
+            if items != value:
+                self._items = array("q", (items, value) if items < value else (value, items))
+            return
+        if not items:
+            self._items = value
+            self._dead = 0
+            return
+        if value > (items[-1] if items[-1] >= 0 else -items[-1] - 1):
+            items.append(value)
+            return
+        pos = self._find(value)
+        if pos < len(items) and items[pos] == -value - 1:  # адрес снова занят - снимаем пометку
+            items[pos] = value
+            self._dead -= 1
+        elif pos == len(items) or items[pos] != value:
+            items.insert(pos, value)
+
+    def extend(self, values):
+        values = sorted(values)
+        if not values:
+            return
+        items = self._array()
+        if not items or values[0] > (items[-1] if items[-1] >= 0 else -items[-1] - 1):
+            items.extend(values)
+            return
+        self._items = array("q", sorted(set(self).union(values)))
+        self._dead = 0
+
+    def remove(self, value: int):
+        items = self._items
+        if type(items) is int:
+            if items != value:
+                raise ValueError(f"{value} нет в списке адресов")
+            self._items = array("q")
+            return
+        pos = self._find(value)
+        if pos == len(items) or items[pos] != value:
+            raise ValueError(f"{value} нет в списке адресов")
+        items[pos] = -value - 1
+        self._dead += 1
+        if self._dead * 2 > len(items):
+            self.compact()
+
+    def compact(self): # удаление помеченных элементов
+        if self._dead:
+            self._items = array("q", (value for value in self._items if value >= 0))
+            self._dead = 0
+
+
+ARRAY_MAX = 4096  # больше значений в контейнере - переходим на битовую карту
+CHUNK_BYTES = 1 << 13  # битовая карта на 2^16 адресов
+BITS = [tuple(bit for bit in range(8) if byte >> bit & 1) for byte in range(256)]
+
+
+class Bitmap: # сжатое множество адресов в стиле roaring: контейнеры по 2^16 адресов
+    __slots__ = ("_chunks", "_count")
+
+    HEADER = struct.Struct("<I")
+    CHUNK = struct.Struct("<IBI")  # старшие биты, тип (0 - массив, 1 - карта), число значений
+
+    def __init__(self, values=()):
+        self._chunks = {}  # старшие биты адреса -> array('H') младших битов или bytearray
+        self._count = 0
+        self.extend(values)  # контейнер за контейнером, а не по одному адресу
+
+    def __len__(self):
+        return self._count
+
+    def __bool__(self):
+        return self._count > 0
+
+    def __contains__(self, value):
+        chunk = self._chunks.get(value >> 16)
+        if chunk is None:
+            return False
+        low = value & 0xFFFF
+        if isinstance(chunk, bytearray):
+            return bool(chunk[low >> 3] >> (low & 7) & 1)
+        pos = bisect.bisect_left(chunk, low)
+        return pos < len(chunk) and chunk[pos] == low
+
+    def __iter__(self): # адреса по возрастанию
+        for high in sorted(self._chunks):
+            chunk = self._chunks[high]
+            base = high << 16
+            if isinstance(chunk, bytearray):
+                for pos, byte in enumerate(chunk):
+                    if byte:
+                        for bit in BITS[byte]:
+                            yield base | pos << 3 | bit
+            else:
+                for low in chunk:
+                    yield base | low
+
+    def __repr__(self):
+        return f"Bitmap({list(self)})"
+
+    def containers(self): # (старшие биты, array('H') младших битов или bytearray-карта) по возрастанию
+        for high in sorted(self._chunks):
+            yield high, self._chunks[high]
+
+    def append(self, value: int): # добавление адреса (повтор игнорируется)
+        high, low = value >> 16, value & 0xFFFF
+        chunk = self._chunks.get(high)
+        if chunk is None:
+            chunk = self._chunks[high] = array("H")
+        if isinstance(chunk, bytearray):
+            if chunk[low >> 3] >> (low & 7) & 1:
+                return
+            chunk[low >> 3] |= 1 << (low & 7)
+        else:
+            pos = bisect.bisect_left(chunk, low)
+            if pos < len(chunk) and chunk[pos] == low:
+                return
+            chunk.insert(pos, low)
+            if len(chunk) > ARRAY_MAX:
+                self._chunks[high] = self._to_bitmap(chunk)
+        self._count += 1
+
+    def extend(self, values): # пакетное добавление: одно слияние на контейнер
+        groups = {}
+        for value in values:
+            groups.setdefault(value >> 16, []).append(value & 0xFFFF)
+        for high, lows in groups.items():
+            chunk = self._chunks.get(high)
+            if isinstance(chunk, bytearray):
+                for low in lows:
+                    if not chunk[low >> 3] >> (low & 7) & 1:
+                        chunk[low >> 3] |= 1 << (low & 7)
+                        self._count += 1
+                continue
+            old = len(chunk) if chunk is not None else 0
+            chunk = array("H", sorted(set(lows).union(chunk or ())))
+            self._count += len(chunk) - old
+            self._chunks[high] = self._to_bitmap(chunk) if len(chunk) > ARRAY_MAX else chunk
+
+    def remove(self, value: int):
+        high, low = value >> 16, value & 0xFFFF
+        chunk = self._chunks.get(high)
+        if chunk is None or value not in self:
+            raise ValueError(f"{value} нет в битовой карте")
+        if isinstance(chunk, bytearray):
+            chunk[low >> 3] &= ~(1 << (low & 7)) & 0xFF
+        else:
+            del chunk[bisect.bisect_left(chunk, low)]
+            if not chunk:
+                del self._chunks[high]
+        self._count -= 1
+
+    @staticmethod
+    def _to_bitmap(chunk) -> bytearray:
+        bits = bytearray(CHUNK_BYTES)
+        for low in chunk:
+            bits[low >> 3] |= 1 << (low & 7)
+        return bits
+
+    @staticmethod
+    def _as_int(chunk) -> int:
+        if not isinstance(chunk, bytearray):
+            chunk = Bitmap._to_bitmap(chunk)
+        return int.from_bytes(chunk, "little")
+
+    @staticmethod
+    def _from_int(bits: int):
+        chunk = bytearray(bits.to_bytes(CHUNK_BYTES, "little"))
+        if bits.bit_count() > ARRAY_MAX:
+            return chunk
+        return array("H", (pos << 3 | bit for pos, byte in enumerate(chunk) if byte for bit in BITS[byte]))
+
+    def _combine(self, other, highs, op):
+        result = Bitmap()
+        for high in highs:
+            bits = op(self._as_int(self._chunks.get(high, array("H"))), self._as_int(other._chunks.get(high, array("H"))))
+            if bits:
+                result._chunks[high] = self._from_int(bits)
+                result._count += bits.bit_count()
+        return result
+
+    def __and__(self, other):
+        return self._combine(other, self._chunks.keys() & other._chunks.keys(), lambda a, b: a & b)
+
+    def __or__(self, other):
+        return self._combine(other, self._chunks.keys() | other._chunks.keys(), lambda a, b: a | b)
+
+    def __sub__(self, other):
+        return self._combine(other, self._chunks.keys(), lambda a, b: a & ~b)
+
+    def and_count(self, other) -> int: # размер пересечения без построения результата
+        total = 0
+        for high in self._chunks.keys() & other._chunks.keys():
+            a, b = self._chunks[high], other._chunks[high]
+            if isinstance(a, bytearray) and isinstance(b, bytearray):
+                total += (self._as_int(a) & self._as_int(b)).bit_count()
+            elif isinstance(a, bytearray) or isinstance(b, bytearray):
+                # массив проверяется по карте, без разворачивания массива в карту
+                bits, lows = (a, b) if isinstance(a, bytearray) else (b, a)
+                total += sum(bits[low >> 3] >> (low & 7) & 1 for low in lows)
+            else:
+                small, large = (a, b) if len(a) <= len(b) else (b, a)
+                if len(small) * 16 < len(large):  # маленький массив ищется в большом бинарным поиском
+                    for low in small:
+                        pos = bisect.bisect_left(large, low)
+                        total += pos < len(large) and large[pos] == low
+                else:
+                    total += len(set(small).intersection(large))
+        return total
+
+    def to_bytes(self) -> bytes:
+        parts = []
+        for high in sorted(self._chunks):
+            chunk = self._chunks[high]
+            if isinstance(chunk, bytearray):
+                count = self._as_int(chunk).bit_count()
+                if count == 0:
+                    continue
+                if count <= ARRAY_MAX:  # после удалений карта снова стала разреженной
+                    chunk = self._from_int(self._as_int(chunk))
+            if isinstance(chunk, bytearray):
+                parts.append(self.CHUNK.pack(high, 1, count) + bytes(chunk))
+            else:
+                parts.append(self.CHUNK.pack(high, 0, len(chunk)) + chunk.tobytes())
+        return self.HEADER.pack(len(parts)) + b"".join(parts)
+
+    @classmethod
+    def from_bytes(cls, data, pos: int = 0):  # -> (битовая карта, позиция после неё)
+        bitmap = cls()
+        (chunks,) = cls.HEADER.unpack_from(data, pos)
+        pos += cls.HEADER.size
+        for _ in range(chunks):
+            high, kind, count = cls.CHUNK.unpack_from(data, pos)
+            pos += cls.CHUNK.size
+            if kind == 1:
+                bitmap._chunks[high] = bytearray(data[pos:pos + CHUNK_BYTES])
+                pos += CHUNK_BYTES
+            else:
+                chunk = array("H")
+                chunk.frombytes(data[pos:pos + count * 2])
+                bitmap._chunks[high] = chunk
+                pos += count * 2
+            bitmap._count += count
+        return bitmap, pos
+
+
+BITMAP_MAGIC = b"MYBM"
+KEY = struct.Struct("<H")
+
+
+def save_bitmap_index(file_path: str, index: dict): # хэш-таблица с битовыми картами в двоичный файл
+    with open(file_path, "wb") as file:
+        file.write(BITMAP_MAGIC)
+        for key, bitmap in index.items():
+            raw = key.encode()
+            file.write(KEY.pack(len(raw)) + raw + bitmap.to_bytes())
+
+
+def load_bitmap_index(data: bytes) -> dict:
+    index = {}
+    pos = len(BITMAP_MAGIC)
+    while pos < len(data):
+        (size,) = KEY.unpack_from(data, pos)
+        pos += KEY.size
+        key = data[pos:pos + size].decode()
+        index[key], pos = Bitmap.from_bytes(data, pos + size)
+    return index
@@ -0,0 +1,108 @@
+import csv
+import os
+
+
+class Journal:  # журнал изменений индексов (только дозапись)
+    def __init__(self, path: str):
+        self.path = path
+        self.ckpt_path = path + ".ckpt"  # номер последней контрольной точки
+        self.checkpoint = self._read_ckpt()
+        self.generation = self._read_generation()
+        self.count = 0  # число записей после контрольной точки
+        self._file = None
+        self._writer = None
+
+    def _read_ckpt(self) -> int:
+        if not os.path.exists(self.ckpt_path):
+            return 0
+        with open(self.ckpt_path, "r") as file:
+            return int(file.read().strip() or 0)
+
+    def _read_generation(self) -> int:  # к какой контрольной точке относится журнал
+        if not os.path.exists(self.path):
+            return self.checkpoint
+        with open(self.path, "r", newline="") as file:
+            header = file.readline()
+        if not header.startswith("#,"):
+            return self.checkpoint
+        return int(header[2:].strip())
+
+    def __len__(self):
+        return self.count
+
+    def recover(self, snapshot_paths):  # доводит до конца прерванную контрольную точку
+        tmp_paths = [path + ".tmp" for path in snapshot_paths if os.path.exists(path + ".tmp")]
+        for tmp_path in tmp_paths:
+            if self.checkpoint > self.generation:
+                os.replace(tmp_path, tmp_path[:-4])  # снимок уже зафиксирован
+            else:
+                os.remove(tmp_path)  # снимок не успели зафиксировать
+        if self.generation < self.checkpoint:
+            # все записи журнала уже вошли в снимок
+            self.reset(self.checkpoint)
+
+    def replay(self):  # записи журнала по порядку
+        self.count = 0
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, "r", newline="") as file:
+            file.readline()
+            for line in file:
+                if not line.endswith("\n"):
+                    break  # недописанная строка после сбоя
+                row = next(csv.reader([line]))
+                self.count += 1
+                if not row[3]:
+                    yield row[0], row[1], row[2], None
+                    continue
+                for offset in row[3:]:  # в одной строке может быть несколько адресов
+                    yield row[0], row[1], row[2], int(offset)
+
+    def _open(self):
+        if self._file is None:
+            if not os.path.exists(self.path):
+                self.reset(self.generation)
+            self._file = open(self.path, "a", newline="")
+            self._writer = csv.writer(self._file, lineterminator="\n")
+
+    def log(self, op: str, field: str, key: str, offset):
+        self._open()
+        self._writer.writerow([op, field, key, "" if offset is None else offset])
+        self.count += 1
+
+    def log_many(self, entries):  # [(операция, поле, ключ, список адресов)]
+        self._open()
+        for op, field, key, offsets in entries:
+            self._writer.writerow([op, field, key] + list(offsets))
+            self.count += 1
+
+    def commit(self, sync: bool = False):  # сброс буфера на диск после операции
+        if self._file is None:
+            return
+        self._file.flush()
+        if sync:
+            os.fsync(self._file.fileno())
+
+    def mark(self, generation: int):  # фиксация новой контрольной точки
+        with open(self.ckpt_path + ".tmp", "w") as file:
+            file.write(f"{generation}\n")
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(self.ckpt_path + ".tmp", self.ckpt_path)
+        self.checkpoint = generation
+
+    def reset(self, generation: int):  # пустой журнал после контрольной точки
+        self.close()
+        with open(self.path, "w", newline="") as file:
+            file.write(f"#,{generation}\n")
+        self.generation = generation
+        self.count = 0
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+            self._writer = None
+
+    def files(self):
+        return [self.path, self.ckpt_path]
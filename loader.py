@@ -0,0 +1,152 @@
+import argparse
+import csv
+import os
+import sys
+import time
+
+from bd import INDEX_ATTRS, _legacy_path, default_index_paths, mydb, service_files
+from storage import FIELDS, detect_kind, open_storage
+
+try:
+    from openpyxl import load_workbook
+except ImportError:
+    load_workbook = None
+
+FORMATS = (".xlsx", ".csv", ".tsv")
+BATCH_ROWS = 50000  # строк источника на одну дозапись в файл данных
+
+# Начальная загрузка новой базы из выгрузки (.xlsx/.csv/.tsv, как у export.py) за один проход:
+# строки источника пачками дописываются в файл данных одной последовательной записью,
+# индексы всех пяти полей строятся в памяти по столбцам пачки, а в конце сохраняются
+# одним снимком (CSV и двоичный) - без журнала, кэшей и поиска свободных слотов,
+# через которые идёт каждая вставка insert/insert_many.
+
+
+def read_rows(source_path: str): # (номер строки, поля) источника; заголовок FIELDS пропускается
+    extension = os.path.splitext(source_path)[1].lower()
+    if extension not in FORMATS:
+        raise ValueError(f"Неизвестный формат источника: {extension or source_path}")
+    if extension == ".xlsx":
+        rows = _xlsx_rows(source_path)
+    else:
+        rows = _text_rows(source_path, "\t" if extension == ".tsv" else ",")
+    rows = enumerate(rows, 1)
+    first = next(rows, None)
+    if first is None:
+        return
+    if first[1] != FIELDS:
+        yield first
+    yield from rows
+
+
+def _xlsx_rows(source_path: str):
+    if load_workbook is None:
+        raise ValueError("Для загрузки из .xlsx нужен пакет openpyxl.")
+    workbook = load_workbook(source_path, read_only=True)  # лист читается потоком, а не целиком
+    try:
+        for row in workbook.active.iter_rows(values_only=True):
+            yield ["" if value is None else str(value) for value in row]
+    finally:
+        workbook.close()
+
+
+def _text_rows(source_path: str, delimiter: str):
+    with open(source_path, "r", newline="") as file:
+        yield from csv.reader(file, delimiter=delimiter)
+
+
+def bulk_load(source_path: str, file_path: str, index_paths: dict, storage: str = None,
+              batch_size: int = BATCH_ROWS) -> mydb:
+    # загрузка в новый файл данных file_path, возвращает открытую базу; строки с неверным
+    # числом полей и с повторяющимся SN пропускаются (с сообщением, как в insert_many)
+    if os.path.exists(file_path):
+        raise ValueError(f"Файл {file_path} уже существует: загрузка возможна только в новую базу.")
+    # индексы и журнал другой базы в той же директории перезаписались бы снимком новой
+    for path in [path for path in index_paths.values() if path is not None] + service_files(index_paths):
+        for existing in (path, _legacy_path(path)):
+            if existing is not None and os.path.exists(existing):
+                raise ValueError(f"Файл {existing} уже существует: для новой базы нужна директория индексов "
+                                 f"без файлов другой базы (--index-dir).")
+    kind = storage or detect_kind(file_path)
+    tmp_path = file_path + ".part"  # до конца загрузки база не видна под своим именем
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+    target = open_storage(tmp_path, kind)
+    indices = [{} for _ in FIELDS]
+    try:
+        batch = []
+        for item in read_rows(source_path):
+            batch.append(item)
+            if len(batch) >= batch_size:
+                _load_batch(target, indices, batch)
+                batch = []
+        if batch:
+            _load_batch(target, indices, batch)
+        target.flush()
+    except BaseException:
+        target.close()
+        os.remove(tmp_path)
+        raise
+    target.close()
+    os.replace(tmp_path, file_path)
+
+    open(index_paths["Removed"], "w").close()
+    db = mydb(file_path, index_paths, kind)
+    with db.lock.write():
+        for field, index in zip(FIELDS, indices):
+            setattr(db, INDEX_ATTRS[field], index)
+        db.removed = []
+        db.checkpoint()  # индексы сразу уходят в снимок: следующее открытие читает двоичный снимок
+    return db
+
+
+def _load_batch(target, indices: list, batch: list):
+    sn_index = indices[0]
+    rows = []
+    for number, row in batch:
+        if len(row) != len(FIELDS):
+            print(f"Строка {number}: ожидалось {len(FIELDS)} полей, а не {len(row)}.")
+            continue
+        sn = row[0]
+        if sn in sn_index:  # индекс SN и есть множество уже загруженных ключей
+            print(f"Значение первичного ключа должно быть уникальным: {sn}")
+            continue
+        sn_index[sn] = None  # место занято сразу: повтор внутри пачки тоже отсекается
+        rows.append(row)
+    if not rows:
+        return
+
+    offsets = target.append_many(rows)
+    columns = zip(*rows)
+    for sn, offset in zip(next(columns), offsets):
+        sn_index[sn] = [offset]
+    for index, column in zip(indices[1:], columns):
+        for key, offset in zip(column, offsets):
+            postings = index.get(key)
+            if postings is None:
+                index[key] = [offset]
+            else:
+                postings.append(offset)
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Загрузка новой базы mydb из выгрузки .xlsx/.csv/.tsv")
+    parser.add_argument("source", help="файл выгрузки (первая строка может быть заголовком)")
+    parser.add_argument("file", help="новый файл базы данных (.csv или .mydb)")
+    parser.add_argument("--index-dir", help="директория файлов индексов (по умолчанию - директория базы)")
+    parser.add_argument("--storage", choices=["csv", "bin"], help="формат хранения (по умолчанию - по расширению)")
+    parser.add_argument("--batch", type=int, default=BATCH_ROWS, help="строк на одну дозапись")
+    args = parser.parse_args(argv)
+
+    paths = default_index_paths(args.index_dir or os.path.dirname(os.path.abspath(args.file)))
+    started = time.perf_counter()
+    db = bulk_load(args.source, args.file, paths, args.storage, args.batch)
+    elapsed = time.perf_counter() - started
+    count = db.count()
+    db.close()
+    print(f"Загружено записей: {count} за {elapsed:.1f} с ({count / elapsed if elapsed else 0:.0f} записей/с)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,154 @@
+import argparse
+import asyncio
+import json
+import os
+import random
+import shutil
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+from bd import mydb, default_index_paths, generate_random_record
+from bench import summary
+from client import AsyncClient
+
+DEFAULT_RECORDS = 10000  # записей в базе, которую нагрузочный тест создаёт сам
+START_TIMEOUT = 30  # секунд на запуск сервера
+
+
+def parse_address(text: str): # "host:port" -> (host, port), остальное - путь Unix-сокета
+    host, sep, port = text.rpartition(":")
+    if sep and port.isdigit():
+        return host, int(port)
+    return text
+
+
+def start_server(records: int, kind: str): # временная база с records записями и сервер над ней
+    directory = tempfile.mkdtemp(prefix="mydb-load-")
+    paths = default_index_paths(directory)
+    open(paths["Removed"], "w").close()
+    data_path = os.path.join(directory, "database." + ("mydb" if kind == "bin" else "csv"))
+    db = mydb(data_path, paths, kind)
+    db.insert_many(generate_random_record(sn) for sn in range(1, records + 1))
+    db.checkpoint()
+    db.close()
+
+    command = [sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), "server.py"), data_path]
+    if hasattr(socket, "AF_UNIX"):
+        address = os.path.join(directory, "mydb.sock")
+        command += ["--unix", address]
+    else:
+        with socket.socket() as probe:  # свободный порт
+            probe.bind(("127.0.0.1", 0))
+            address = ("127.0.0.1", probe.getsockname()[1])
+        command += ["--port", str(address[1])]
+    process = subprocess.Popen(command, stdout=subprocess.DEVNULL)
+    return process, address, directory
+
+
+async def wait_ready(address):
+    deadline = time.monotonic() + START_TIMEOUT
+    while True:
+        try:
+            client = await AsyncClient.connect(address)
+            await client.call("count")
+            return client
+        except OSError:
+            if time.monotonic() > deadline:
+                raise
+            await asyncio.sleep(0.05)
+
+
+async def run_client(address, number: int, requests: int, depth: int, writes: float, keys: int, latencies: dict):
+    # depth запросов одного клиента в полёте одновременно (конвейер по одному соединению)
+    client = await AsyncClient.connect(address)
+    rng = random.Random(number)
+    next_sn = keys + 1 + number * requests  # SN новых записей у клиентов не пересекаются
+    queue = list(range(requests))
+
+    async def worker():
+        nonlocal next_sn
+        while queue:
+            queue.pop()
+            if rng.random() < writes:
+                if rng.random() < 0.5:
+                    op, args = "insert", (generate_random_record(next_sn),)
+                    next_sn += 1
+                else:
+                    op, args = "update", (generate_random_record(rng.randint(1, keys)),)
+            elif rng.random() < 0.8:
+                op, args = "search", ("SN", f"{rng.randint(1, keys):06d}")
+            else:
+                op, args = "query", (["and", ["Sold", "+"], ["Compliance Index", "0.50", "0.52"]],)
+            start = time.perf_counter()
+            await client.call(op, *args)
+            latencies.setdefault(op, []).append(time.perf_counter() - start)
+
+    await asyncio.gather(*(worker() for _ in range(depth)))
+    await client.close()
+
+
+async def load(address, clients: int, requests: int, depth: int, writes: float, keys: int) -> dict:
+    probe = await wait_ready(address)
+    await probe.close()
+    latencies = {}
+    start = time.perf_counter()
+    await asyncio.gather(*(run_client(address, number, requests, depth, writes, keys, latencies)
+                           for number in range(clients)))
+    elapsed = time.perf_counter() - start
+    total = sum(len(values) for values in latencies.values())
+    report = {op: summary(values) for op, values in sorted(latencies.items())}
+    report["all"] = summary([value for values in latencies.values() for value in values])
+    report["all"]["elapsed_s"] = round(elapsed, 3)
+    report["all"]["requests_per_s"] = round(total / elapsed, 1) if elapsed else None
+    return report
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Нагрузочный тест сервера mydb")
+    parser.add_argument("--address", help="host:port или путь Unix-сокета; без него запускается свой сервер")
+    parser.add_argument("--records", type=int, default=DEFAULT_RECORDS, help="записей во временной базе")
+    parser.add_argument("--keys", type=int, help="SN существующих записей 1..keys (по умолчанию --records)")
+    parser.add_argument("--storage", choices=["csv", "bin"], default="csv")
+    parser.add_argument("--clients", type=int, default=8, help="одновременных соединений")
+    parser.add_argument("--requests", type=int, default=2000, help="запросов на клиента")
+    parser.add_argument("--depth", type=int, default=16, help="запросов в полёте на клиента")
+    parser.add_argument("--writes", type=float, default=0.2, help="доля изменяющих запросов")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", help="файл с результатами (JSON)")
+    args = parser.parse_args(argv)
+
+    random.seed(args.seed)
+    process = directory = None
+    if args.address:
+        address = parse_address(args.address)
+    else:
+        print(f"Временная база на {args.records} записей...")
+        process, address, directory = start_server(args.records, args.storage)
+    try:
+        report = asyncio.run(load(address, args.clients, args.requests, args.depth, args.writes,
+                                  args.keys or args.records))
+    finally:
+        if process is not None:
+            if os.name == "nt":
+                process.terminate()  # изменения уже в журнале, он применится при следующем открытии
+            else:
+                process.send_signal(signal.SIGINT)  # сервер сохраняет индексы и закрывает базу
+            process.wait(START_TIMEOUT)
+            shutil.rmtree(directory, ignore_errors=True)
+
+    for op, stats in report.items():
+        print(f"  {op:<8} {stats['count']:>8}  p50 {stats['p50_ms']:>9.3f} ms  p95 {stats['p95_ms']:>9.3f} ms  "
+              f"p99 {stats['p99_ms']:>9.3f} ms")
+    print(f"  {report['all']['requests_per_s']} запросов/с за {report['all']['elapsed_s']} с")
+    if args.out:
+        with open(args.out, "w") as file:
+            json.dump(report, file, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
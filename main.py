@@ -8,8 +8,8 @@ if __name__ == "__main__":
         "SN": "index_sn.csv",
         "Name": "index_name.csv",
         "Date": "index_date.csv",
-        "Compliance Index": "index_compliance_index.csv",
-        "Sold": "index_sold.csv",
+        "Compliance Index": "index_compliance_index.bm",
+        "Sold": "index_sold.bm",
         "Removed": "removed.txt"
     }
     # объект бд
@@ -0,0 +1,179 @@
+import cProfile
+import functools
+import io
+import json
+import pstats
+import threading
+import time
+import tracemalloc
+from collections import deque
+from contextlib import contextmanager
+
+BUCKETS = 40  # корзина i - задержки до 2^i микросекунд
+# доли попаданий: имя -> (счётчик попаданий, счётчик промахов)
+RATIOS = {"cache_hit_ratio": ("cache_hits", "cache_misses"), "index_hit_ratio": ("index_hits", "index_misses"),
+          "query_cache_hit_ratio": ("query_cache_hits", "query_cache_misses")}
+
+
+class Histogram: # гистограмма задержек с корзинами по степеням двойки
+    __slots__ = ("buckets", "count", "total", "max")
+
+    def __init__(self):
+        self.buckets = [0] * BUCKETS
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, seconds: float):
+        self.buckets[min(BUCKETS - 1, int(seconds * 1e6).bit_length())] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def percentile(self, share: float) -> float: # верхняя граница корзины, в которую попал процентиль (мс)
+        rank = share * self.count
+        seen = 0
+        for i, bucket in enumerate(self.buckets):
+            seen += bucket
+            if bucket and seen >= rank:
+                return min((1 << i) / 1000, self.max * 1000)
+        return self.max * 1000
+
+    def summary(self) -> dict:
+        return {
+            "count": self.count,
+            "total_ms": round(self.total * 1000, 3),
+            "p50_ms": round(self.percentile(0.50), 3),
+            "p95_ms": round(self.percentile(0.95), 3),
+            "p99_ms": round(self.percentile(0.99), 3),
+            "max_ms": round(self.max * 1000, 3),
+        }
+
+
+class Metrics: # счётчики и задержки операций mydb; выключенные почти ничего не стоят
+    def __init__(self, enabled: bool = False):
+        self.enabled = enabled
+        self.sinks = []  # получатели событий: объекты с методом emit(event)
+        self.profiled = set()  # операции, которые выполняются под cProfile
+        self.profiles = {}  # последний отчёт профилирования по каждой метке
+        # чтения идут параллельно: счётчики и гистограммы меняются под замком (только включённые)
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.counters = {}
+            self.histograms = {}
+
+    def count(self, name: str, n: int = 1):
+        if self.enabled:
+            with self._lock:
+                self.counters[name] = self.counters.get(name, 0) + n
+
+    def observe(self, op: str, seconds: float): # вызывается только для включённых метрик (instrumented)
+        with self._lock:
+            histogram = self.histograms.get(op)
+            if histogram is None:
+                histogram = self.histograms[op] = Histogram()
+            histogram.add(seconds)
+        if self.sinks:
+            self.emit({"event": "op", "op": op, "ms": round(seconds * 1000, 4), "time": time.time()})
+
+    def emit(self, event: dict):
+        for sink in self.sinks:
+            sink.emit(event)
+
+    def add_sink(self, sink):
+        self.sinks.append(sink)
+        return sink
+
+    def remove_sink(self, sink):
+        if sink in self.sinks:
+            self.sinks.remove(sink)
+
+    def snapshot(self) -> dict: # текущее состояние: счётчики, доли попаданий и задержки по операциям
+        with self._lock:
+            counters = dict(self.counters)
+            latency = {op: histogram.summary() for op, histogram in self.histograms.items()}
+        ratios = {}
+        for name, (hits, misses) in RATIOS.items():
+            total = counters.get(hits, 0) + counters.get(misses, 0)
+            if total:
+                ratios[name] = round(counters.get(hits, 0) / total, 4)
+        return {
+            "counters": counters,
+            "ratios": ratios,
+            "latency": latency,
+        }
+
+    @contextmanager
+    def capture(self, label: str, memory: bool = False, top: int = 15):
+        # профилирование произвольного участка: with db.metrics.capture("search"): db.search(...)
+        # memory=True - ещё и выделения памяти через tracemalloc
+        profiler = cProfile.Profile()
+        tracing = memory and not tracemalloc.is_tracing()
+        if tracing:
+            tracemalloc.start()
+        start = time.perf_counter()
+        profiler.enable()
+        try:
+            yield
+        finally:
+            profiler.disable()
+            elapsed = time.perf_counter() - start
+            report = {"event": "profile", "label": label, "ms": round(elapsed * 1000, 4)}
+            text = io.StringIO()
+            pstats.Stats(profiler, stream=text).sort_stats("cumulative").print_stats(top)
+            report["profile"] = text.getvalue()
+            if memory:
+                current, peak = tracemalloc.get_traced_memory()
+                stats = tracemalloc.take_snapshot().statistics("lineno")[:top]
+                report["memory"] = {"current_kb": current // 1024, "peak_kb": peak // 1024,
+                                    "top": [str(stat) for stat in stats]}
+                if tracing:
+                    tracemalloc.stop()
+            self.profiles[label] = report
+            self.emit(report)
+
+
+def instrumented(op: str): # замер времени метода mydb (self.metrics); выключено - прямой вызов
+    def decorate(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            metrics = self.metrics
+            if not metrics.enabled:
+                return method(self, *args, **kwargs)
+            start = time.perf_counter()
+            try:
+                if op in metrics.profiled:
+                    with metrics.capture(op):
+                        return method(self, *args, **kwargs)
+                return method(self, *args, **kwargs)
+            finally:
+                metrics.observe(op, time.perf_counter() - start)
+        return wrapper
+    return decorate
+
+
+class MemorySink: # последние события в памяти
+    def __init__(self, limit: int = 10000):
+        self.events = deque(maxlen=limit)
+
+    def emit(self, event: dict):
+        self.events.append(event)
+
+
+class JsonLinesSink: # события построчно в файл JSON Lines
+    def __init__(self, file_path: str):
+        self.file_path = file_path
+        self._file = open(file_path, "a")
+
+    def emit(self, event: dict):
+        self._file.write(json.dumps(event, ensure_ascii=False) + "\n")
+
+    def flush(self):
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
@@ -0,0 +1,47 @@
+import json
+import struct
+
+DEFAULT_PORT = 7878
+FRAME = struct.Struct(">I")  # длина тела сообщения перед каждым сообщением
+MAX_FRAME = 64 << 20  # больше - ошибка протокола, а не огромное выделение памяти
+
+# Сообщение - JSON-массив в кадре с длиной:
+#   запрос  [id, операция, [аргументы]]
+#   ответ   [id, true, результат] или [id, false, текст ошибки]
+# Ответы на запросы одного соединения идут в том же порядке, что и запросы,
+# поэтому клиент может отправить много запросов, не дожидаясь ответов (конвейер).
+
+
+def pack(message) -> bytes: # кадр длиннее MAX_FRAME не собирается: другая сторона его всё равно не примет
+    body = json.dumps(message, ensure_ascii=False, separators=(",", ":")).encode()
+    return FRAME.pack(_check(len(body))) + body
+
+
+def unpack(body: bytes):
+    return json.loads(body)
+
+
+def _check(size: int) -> int:
+    if size > MAX_FRAME:
+        raise ValueError(f"Слишком длинное сообщение: {size} байт.")
+    return size
+
+
+async def read_message(reader): # следующее сообщение из asyncio-потока, None - соединение закрыто
+    try:
+        head = await reader.readexactly(FRAME.size)
+        body = await reader.readexactly(_check(FRAME.unpack(head)[0]))
+    except EOFError:
+        return None
+    return unpack(body)
+
+
+def recv_message(file): # то же из файла сокета (socket.makefile("rb"))
+    head = file.read(FRAME.size)
+    if len(head) < FRAME.size:
+        return None
+    size = _check(FRAME.unpack(head)[0])
+    body = file.read(size)
+    if len(body) < size:
+        return None
+    return unpack(body)
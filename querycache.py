@@ -0,0 +1,76 @@
+import threading
+from collections import OrderedDict
+
+MODES = ("records", "offsets")
+
+
+class CachedResult:  # ответ на запрос и поколения полей, при которых он был получен
+    __slots__ = ("fields", "stamp", "offsets", "records", "cost")
+
+    def __init__(self, fields, stamp, offsets, records):
+        self.fields = fields  # от каких полей зависит ответ
+        self.stamp = stamp
+        self.offsets = offsets
+        self.records = records  # None в режиме "offsets"
+        self.cost = max(1, len(offsets) * (1 if records is None else 1 + len(fields)))
+
+
+class QueryCache:  # кэш ответов search/query с вытеснением давно не использованных (LRU)
+    # Ответ действителен, пока не изменились поколения записи его полей: вставка,
+    # обновление и удаление увеличивают поколение каждого затронутого поля.
+    # Режим "records" хранит готовые записи - они зависят от всех полей записи;
+    # режим "offsets" хранит только адреса - зависят лишь поля из условия запроса,
+    # а сами записи перечитываются (через кэш записей файла данных).
+    def __init__(self, mode: str = "records", budget: int = 1000000):
+        if mode not in MODES:
+            raise ValueError(f"Неизвестный режим кэша запросов: {mode}")
+        self.mode = mode
+        self.budget = budget  # предел числа хранимых адресов (запись считается за несколько)
+        self.size = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()  # к кэшу обращаются параллельные читатели mydb
+
+    def __len__(self):
+        return len(self._entries)
+
+    def admits(self, count: int, width: int) -> bool: # поместится ли ответ из count записей по width полей
+        cost = max(1, count * (1 + width if self.mode == "records" else 1))
+        return cost * 4 <= self.budget  # то же правило, что в put
+
+    def get(self, key, generations: dict):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if tuple(generations[field] for field in entry.fields) != entry.stamp:
+                self._drop(key)  # с тех пор поле менялось
+                return None
+            self._entries.move_to_end(key)
+            return entry
+
+    def put(self, key, fields, generations: dict, offsets: list, records: list = None):
+        # fields - поля условия; в режиме "records" ответ зависит от всех полей из generations
+        if self.mode == "records":
+            fields = tuple(generations)
+        else:
+            records = None
+        entry = CachedResult(tuple(fields), tuple(generations[field] for field in fields), offsets, records)
+        with self._lock:
+            self._drop(key)
+            if entry.cost * 4 > self.budget:
+                return  # слишком большой ответ вытеснил бы весь кэш
+            self._entries[key] = entry
+            self.size += entry.cost
+            while self.size > self.budget:
+                _, old = self._entries.popitem(last=False)
+                self.size -= old.cost
+
+    def _drop(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.size -= entry.cost
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
@@ -0,0 +1,102 @@
+import functools
+import threading
+from contextlib import contextmanager
+
+
+class RWLock: # много читателей или один писатель; писатель, ждущий очереди, не пропускает новых читателей
+    # Повторный вход разрешён: писатель может снова взять запись или чтение (операция вызывает
+    # другую операцию), читатель - снова чтение. Переход от чтения к записи в одном потоке -
+    # ошибка: два таких читателя ждали бы друг друга вечно.
+    def __init__(self):
+        self._mutex = threading.Lock()
+        self._cond = threading.Condition(self._mutex)
+        self._readers = 0
+        self._writer = None  # поток, держащий запись
+        self._writes = 0  # глубина повторного входа писателя
+        self._waiting = 0  # писателей в очереди
+        self._local = threading.local()  # глубина чтения в текущем потоке
+
+    def acquire_read(self):
+        if self._writer == threading.get_ident():
+            return  # писатель читает своё
+        local = self._local
+        depth = getattr(local, "depth", 0)
+        if not depth:
+            self._mutex.acquire()  # acquire/release, а не with Condition: чтение - горячий путь
+            try:
+                while self._writer is not None or self._waiting:
+                    self._cond.wait()
+                self._readers += 1
+            finally:
+                self._mutex.release()
+        local.depth = depth + 1
+
+    def release_read(self):
+        if self._writer == threading.get_ident():
+            return
+        local = self._local
+        local.depth -= 1
+        if not local.depth:
+            self._mutex.acquire()
+            self._readers -= 1
+            if not self._readers and self._waiting:
+                self._cond.notify_all()
+            self._mutex.release()
+
+    @contextmanager
+    def read(self):
+        self.acquire_read()
+        try:
+            yield
+        finally:
+            self.release_read()
+
+    @contextmanager
+    def write(self):
+        me = threading.get_ident()
+        if self._writer == me:
+            self._writes += 1
+            try:
+                yield
+            finally:
+                self._writes -= 1
+            return
+        if getattr(self._local, "depth", 0):
+            raise RuntimeError("Запись под блокировкой чтения в том же потоке невозможна.")
+        with self._cond:
+            self._waiting += 1
+            try:
+                while self._writer is not None or self._readers:
+                    self._cond.wait()
+            except BaseException:
+                self._waiting -= 1
+                self._cond.notify_all()  # читатели ждали этого писателя
+                raise
+            self._waiting -= 1
+            self._writer = me
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._writer = None
+                self._cond.notify_all()
+
+
+def reading(method): # метод выполняется под блокировкой чтения self.lock
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        lock = self.lock
+        lock.acquire_read()  # без контекстного менеджера: чтения частые и короткие
+        try:
+            return method(self, *args, **kwargs)
+        finally:
+            lock.release_read()
+    return wrapper
+
+
+def writing(method): # метод выполняется под блокировкой записи self.lock
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self.lock.write():
+            return method(self, *args, **kwargs)
+    return wrapper
@@ -0,0 +1,105 @@
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from storage import FIELDS, REMOVED, REMOVED_SN, open_storage
+
+SCAN_MIN_BYTES = 32 << 20  # файл меньше читается в одном процессе: запуск процессов дороже прохода
+RANGE_BYTES = 64 << 20  # примерный размер части файла для одного задания
+
+# Проход по файлу данных частями: файл делится на диапазоны по границам записей
+# (storage.ranges), каждый диапазон читает отдельный процесс, результаты собираются
+# в порядке файла - адреса записей остаются теми же, что при последовательном чтении.
+# Задание - функция уровня модуля task(storage, start, stop, *args): она и её аргументы
+# передаются в процессы через pickle.
+
+
+def _run(job): # выполняется в процессе пула: своё открытие файла и одно задание
+    kind, file_path, start, stop, task, args = job
+    storage = open_storage(file_path, kind)
+    try:
+        return task(storage, start, stop, *args)
+    finally:
+        storage.close()
+
+
+def scan_iter(storage, task, *args, workers: int = None, min_bytes: int = None):
+    # результаты task по частям файла в порядке файла; в работе не больше 2 * workers частей,
+    # так что память не растёт с размером файла, если результаты сразу потребляются
+    workers = workers or os.cpu_count() or 1
+    min_bytes = SCAN_MIN_BYTES if min_bytes is None else min_bytes
+    storage.flush()  # процессы читают файл сами - всё записанное должно быть на диске
+    size = os.path.getsize(storage.file_path)
+    if workers == 1 or size < min_bytes:
+        yield task(storage, 0, None, *args)
+        return
+    parts = max(workers, size // RANGE_BYTES)
+    jobs = [(storage.kind, storage.file_path, start, stop, task, args) for start, stop in storage.ranges(parts)]
+    storage.metrics.count("parallel_scans")
+    storage.metrics.count("bytes_read", size)
+    with ProcessPoolExecutor(max_workers=min(workers, len(jobs) or 1)) as executor:
+        running = deque()
+        for job in jobs:
+            running.append(executor.submit(_run, job))
+            if len(running) >= 2 * workers:
+                yield running.popleft().result()
+        while running:
+            yield running.popleft().result()
+
+
+def scan(storage, task, *args, workers: int = None, min_bytes: int = None) -> list:
+    return list(scan_iter(storage, task, *args, workers=workers, min_bytes=min_bytes))
+
+
+def merge_postings(parts) -> dict: # хэш-таблицы частей -> одна; адреса частей идут по возрастанию
+    index = {}
+    for part in parts:
+        for key, offsets in part.items():
+            postings = index.get(key)
+            if postings is None:
+                index[key] = offsets
+            else:
+                postings.extend(offsets)
+    return index
+
+
+def index_range(storage, start, stop) -> tuple: # хэш-таблицы всех полей и удалённые адреса части файла
+    indices = [{} for _ in FIELDS]
+    removed = []
+    for offset, fields in storage.records(start, stop):
+        if fields[0] == REMOVED_SN:
+            removed.append(offset)
+            continue
+        for index, value in zip(indices, fields):
+            postings = index.get(value)
+            if postings is None:
+                index[value] = [offset]
+            else:
+                postings.append(offset)
+    return indices, removed
+
+
+def merge_indices(results) -> tuple: # результаты index_range -> ({поле: хэш-таблица}, removed)
+    removed = []
+    for _, part in results:
+        removed.extend(part)
+    return {field: merge_postings(indices[i] for indices, _ in results) for i, field in enumerate(FIELDS)}, removed
+
+
+def field_range(storage, start, stop, position: int) -> dict: # значение поля -> адреса живых записей
+    index = {}
+    for offset, fields in storage.records(start, stop, skip_removed=True):
+        index.setdefault(fields[position], []).append(offset)
+    return index
+
+
+def live_range(storage, start, stop) -> bytes: # байты живых записей части файла без разбора полей
+    return b"".join(raw for _, raw in storage.raw_records(start, stop) if not raw.startswith(REMOVED))
+
+
+def filter_range(storage, start, stop, predicate) -> list: # [(адрес, поля)] живых записей, где predicate(запись)
+    found = []
+    for offset, fields in storage.records(start, stop, skip_removed=True):
+        if predicate(dict(zip(FIELDS, fields))):
+            found.append((offset, fields))
+    return found
@@ -0,0 +1,165 @@
+import argparse
+import asyncio
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+from bd import mydb, default_index_paths
+from protocol import DEFAULT_PORT, pack, read_message
+from shards import PARTITIONS, shardeddb
+
+BATCH_MAX = 256  # запросов в одной пачке (и одной фиксации журнала)
+QUEUE_MAX = 10000  # запросов в очереди, дальше чтение из соединений ждёт
+OPS = ("search", "search_text", "query", "insert", "update", "delete", "count")
+
+
+def _failure(message, error: Exception) -> list: # ответ с ошибкой на запрос
+    request_id = message[0] if isinstance(message, list) and message else None
+    return [request_id, False, str(error) or type(error).__name__]
+
+
+def _tuples(expr): # условие запроса из JSON (списки) -> кортежи, как их принимает mydb.query
+    if isinstance(expr, list):
+        return tuple(_tuples(item) for item in expr)
+    return expr
+
+
+class dbserver: # сервер mydb: запросы всех соединений выполняются по очереди пачками
+    # Соединения только читают кадры и кладут запросы в общую очередь. Диспетчер забирает
+    # из очереди всё, что успело накопиться (до BATCH_MAX), и выполняет пачку в одном
+    # рабочем потоке внутри db.batch(): изменения всей пачки фиксируются в журнале разом
+    # (групповая фиксация), а к mydb обращается только этот поток.
+    def __init__(self, db, sync: bool = False):
+        self.db = db
+        self.sync = sync  # fsync журнала после каждой пачки
+        self.requests = 0
+        self.batches = 0
+        self._queue = None
+        self._executor = ThreadPoolExecutor(max_workers=1)
+
+    async def serve(self, path: str = None, host: str = "127.0.0.1", port: int = DEFAULT_PORT):
+        # path - Unix-сокет, иначе TCP на host:port
+        self._queue = asyncio.Queue(QUEUE_MAX)
+        if path is not None:
+            if os.path.exists(path):
+                os.remove(path)  # сокет от прошлого запуска
+            server = await asyncio.start_unix_server(self._connection, path)
+        else:
+            server = await asyncio.start_server(self._connection, host, port)
+        dispatcher = asyncio.create_task(self._dispatch())
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            dispatcher.cancel()
+            if path is not None and os.path.exists(path):
+                os.remove(path)
+
+    async def _connection(self, reader, writer):
+        try:
+            while True:
+                message = await read_message(reader)
+                if message is None:
+                    break
+                await self._queue.put((writer, message))
+        except (ConnectionError, ValueError):
+            pass  # оборванное соединение или кадр не по протоколу
+        # закрывается после ответов на уже принятые запросы
+        await self._queue.put((writer, None))
+
+    async def _dispatch(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            while len(batch) < BATCH_MAX and not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+            try:
+                replies = await loop.run_in_executor(self._executor, self._execute, batch)
+            except Exception as e:
+                # пачка не выполнилась целиком (например, не записался журнал): каждому
+                # запросу - ответ с ошибкой, а диспетчер продолжает работать
+                replies = [None if message is None else pack(_failure(message, e)) for _, message in batch]
+            written = []
+            closed = []
+            for (writer, message), reply in zip(batch, replies):
+                if writer.is_closing():
+                    continue
+                if message is None:
+                    closed.append(writer)
+                    continue
+                writer.write(reply)
+                if writer not in written:
+                    written.append(writer)
+            for writer in written:
+                try:
+                    await writer.drain()
+                except ConnectionError:
+                    writer.close()
+            for writer in closed:
+                writer.close()
+
+    def _execute(self, batch) -> list: # в рабочем потоке: пачка запросов -> кадры ответов
+        replies = []
+        with self.db.batch(self.sync):
+            for _, message in batch:
+                if message is None:
+                    replies.append(None)
+                    continue
+                replies.append(self._reply(message))
+                self.requests += 1
+        self.batches += 1
+        return replies
+
+    def _reply(self, message) -> bytes: # кадр ответа; результат, который не уходит в кадр, - ошибка этого запроса
+        try:
+            return pack(self._call(message))
+        except (ValueError, TypeError) as e:  # длиннее MAX_FRAME или не переводится в JSON
+            return pack(_failure(message, e))
+
+    def _call(self, message) -> list:
+        try:
+            request_id, op, args = message
+            if op not in OPS:
+                raise ValueError(f"Неизвестная операция: {op}")
+            if op == "query":
+                args = [_tuples(arg) for arg in args]
+            return [request_id, True, getattr(self.db, op)(*args)]
+        except Exception as e:
+            return _failure(message, e)
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Сервер mydb")
+    parser.add_argument("file", help="файл базы данных (.csv или .mydb), с --shards - директория шардов")
+    parser.add_argument("--index-dir", help="директория файлов индексов (по умолчанию - директория базы)")
+    parser.add_argument("--storage", choices=["csv", "bin"], help="формат хранения нового файла")
+    parser.add_argument("--unix", help="путь Unix-сокета (вместо TCP)")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--sync", action="store_true", help="fsync журнала после каждой пачки")
+    parser.add_argument("--shards", type=int, help="число шардов новой базы (существующая открывается как есть)")
+    parser.add_argument("--partition", choices=PARTITIONS, help="разбиение по SN: хэш или диапазоны")
+    args = parser.parse_args(argv)
+
+    if args.shards or args.partition or os.path.isdir(args.file):
+        db = shardeddb(args.file, args.shards, args.partition, args.storage)
+    else:
+        paths = default_index_paths(args.index_dir or os.path.dirname(os.path.abspath(args.file)))
+        if not os.path.exists(paths["Removed"]):
+            open(paths["Removed"], "w").close()
+        db = mydb(args.file, paths, args.storage)
+    server = dbserver(db, args.sync)
+    print(f"mydb: {args.file}, " + (f"сокет {args.unix}" if args.unix else f"{args.host}:{args.port}"))
+    try:
+        asyncio.run(server.serve(args.unix, args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        db.save_indices()
+        db.close()
+        print(f"Обработано запросов: {server.requests}, пачек: {server.batches}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,219 @@
+import json
+import os
+import threading
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack, contextmanager
+
+from bd import INDEX_ATTRS, ORDERED, mydb, default_index_paths
+
+PARTITIONS = ("hash", "range")
+SN_SPACE = 10 ** 6  # SN - шесть цифр: 000000..999999
+LAYOUT_FILE = "shards.json"  # число шардов и способ разбиения - с ними база и открывается
+
+# Записи разложены по SN на N независимых баз mydb (шардов), у каждой свои файл данных,
+# индексы, removed и журнал в поддиректории shard_NN. Поиск по SN идёт в один шард,
+# поиск по другим полям - во все шарды параллельно (scatter-gather), ответы сливаются
+# в порядке SN (search_range - в порядке поля, затем SN), так что порядок не зависит
+# от числа шардов. Адрес записи - пара (номер шарда, адрес в шарде).
+
+
+def _sn_order(record):
+    return record["SN"]
+
+
+class shardeddb:
+    def __init__(self, directory: str, shards: int = None, partition: str = None, storage: str = None, **options):
+        # shards/partition/storage нужны при создании; у существующей базы берутся из shards.json
+        self.directory = directory
+        layout = self._layout(shards, partition, storage)
+        self.partition = layout["partition"]
+        self.kind = layout["storage"]
+        self.shards = []
+        for number in range(layout["shards"]):
+            shard_dir = os.path.join(directory, f"shard_{number:02d}")
+            os.makedirs(shard_dir, exist_ok=True)
+            paths = default_index_paths(shard_dir)
+            if not os.path.exists(paths["Removed"]):
+                open(paths["Removed"], "w").close()
+            data_path = os.path.join(shard_dir, "database." + ("mydb" if self.kind == "bin" else "csv"))
+            self.shards.append(mydb(data_path, paths, self.kind, **options))
+        self._pool = ThreadPoolExecutor(max_workers=len(self.shards))
+        self._local = threading.local()  # глубина batch() в текущем потоке
+
+    def _layout(self, shards, partition, storage) -> dict:
+        path = os.path.join(self.directory, LAYOUT_FILE)
+        if os.path.exists(path):
+            with open(path, "r") as file:
+                layout = json.load(file)
+            for name, value in (("shards", shards), ("partition", partition), ("storage", storage)):
+                if value is not None and value != layout[name]:
+                    raise ValueError(f"База {self.directory} создана с {name}={layout[name]}, а не {value}.")
+            return layout
+        layout = {"shards": shards or 4, "partition": partition or "hash", "storage": storage or "csv"}
+        if layout["shards"] < 1:
+            raise ValueError("Число шардов должно быть положительным.")
+        if layout["partition"] not in PARTITIONS:
+            raise ValueError(f"Неизвестный способ разбиения: {layout['partition']}")
+        os.makedirs(self.directory, exist_ok=True)
+        with open(path, "w") as file:
+            json.dump(layout, file)
+        return layout
+
+    def shard_of(self, sn: str) -> int: # номер шарда записи с этим SN
+        if self.partition == "range":
+            if not sn.isdigit():
+                raise ValueError(f"SN {sn!r} должен состоять из цифр.")
+            return min(len(self.shards) - 1, int(sn) * len(self.shards) // SN_SPACE)
+        return zlib.crc32(sn.encode()) % len(self.shards)  # не hash(): он разный в разных процессах
+
+    def _map(self, func, items) -> list: # func по элементам параллельно в пуле потоков
+        if len(items) == 1 or getattr(self._local, "depth", 0):
+            # внутри batch() блокировки записи шардов держит этот поток - потоки пула ждали бы их вечно
+            return [func(item) for item in items]
+        return list(self._pool.map(func, items))
+
+    def _each(self, method: str, *args, shards=None) -> list: # вызов во всех (или в указанных) шардах
+        return self._map(lambda db: getattr(db, method)(*args), self.shards if shards is None else shards)
+
+    def _gather(self, method: str, *args, order=_sn_order) -> list:
+        return sorted((record for part in self._each(method, *args) for record in part), key=order)
+
+    def _route(self, expr): # шард, которым ограничен запрос (условие SN = значение), иначе None
+        if expr[0] == "SN" and len(expr) == 2:
+            return self.shard_of(str(expr[1]))
+        if expr[0] == "and":
+            for sub in expr[1:]:
+                number = self._route(sub)
+                if number is not None:
+                    return number
+        return None
+
+    def search(self, field: str, value: str) -> list[dict]:
+        if field == "SN":
+            return self.shards[self.shard_of(str(value))].search(field, value)
+        return self._gather("search", field, value)
+
+    def search_text(self, field: str, text: str, mode: str = "prefix") -> list[dict]:
+        return self._gather("search_text", field, text, mode)
+
+    def search_range(self, field: str, lo: str = None, hi: str = None) -> list[dict]:
+        sort_key = ORDERED.get(field, str)
+        return self._gather("search_range", field, lo, hi, order=lambda record: (sort_key(record[field]), record["SN"]))
+
+    def query(self, expr) -> list[dict]:
+        number = self._route(expr)
+        if number is not None:
+            return self.shards[number].query(expr)
+        return self._gather("query", expr)
+
+    def aggregate(self, group_by: str = None, value: str = None, funcs=("count",), where=None) -> dict:
+        # шарды считают count и sum (для avg) вместе с запрошенным, итог сводится здесь
+        needed = set(funcs) | {"count"}
+        if "avg" in needed:
+            needed.add("sum")
+        needed.discard("avg")
+        sort_key = ORDERED.get(value, str)
+        merged = {}
+        for part in self._each("aggregate", group_by, value, tuple(sorted(needed)), where):
+            for group, row in part.items():
+                total = merged.get(group)
+                if total is None:
+                    merged[group] = dict(row)
+                    continue
+                total["count"] += row["count"]
+                if "sum" in row:
+                    total["sum"] += row["sum"]
+                if "min" in row:
+                    total["min"] = min(total["min"], row["min"], key=sort_key)
+                if "max" in row:
+                    total["max"] = max(total["max"], row["max"], key=sort_key)
+        result = {}
+        for group, total in merged.items():
+            if "avg" in funcs:
+                total["avg"] = total["sum"] / total["count"]
+            result[group] = {func: total[func] for func in funcs}
+        return result
+
+    def count(self) -> int:
+        return sum(self._each("count"))
+
+    def iter_records(self, skip_removed: bool = True): # ((шард, адрес), поля) шард за шардом
+        for number, db in enumerate(self.shards):
+            for offset, fields in db.iter_records(skip_removed):
+                yield (number, offset), fields
+
+    def insert(self, record: dict):
+        number = self.shard_of(record["SN"])
+        offset = self.shards[number].insert(record)
+        return None if offset is None else (number, offset)
+
+    def insert_many(self, records, batch_size: int = 10000) -> int: # пачка раскладывается по шардам, шарды пишут параллельно
+        inserted = 0
+        groups = [[] for _ in self.shards]
+        pending = 0
+        for record in records:
+            groups[self.shard_of(record["SN"])].append(record)
+            pending += 1
+            if pending >= batch_size:
+                inserted += self._insert_groups(groups)
+                groups = [[] for _ in self.shards]
+                pending = 0
+        if pending:
+            inserted += self._insert_groups(groups)
+        return inserted
+
+    def _insert_groups(self, groups) -> int:
+        jobs = [(db, group) for db, group in zip(self.shards, groups) if group]
+        return sum(self._map(lambda job: job[0].insert_many(job[1]), jobs))
+
+    def update(self, record: dict):
+        number = self.shard_of(record["SN"])
+        return number, self.shards[number].update(record)
+
+    def delete(self, field: str, value: str) -> list:
+        if field == "SN":
+            numbers = [self.shard_of(str(value))]
+        else:
+            numbers = [number for number, db in enumerate(self.shards) if self._holds(db, field, value)]
+            if not numbers:
+                print(f"Записи с {field} = {value} не найдены.")
+                return []
+        parts = self._each("delete", field, value, shards=[self.shards[number] for number in numbers])
+        return [(number, offset) for number, offsets in zip(numbers, parts) for offset in offsets]
+
+    @staticmethod
+    def _holds(db, field: str, value: str) -> bool: # есть ли в шарде записи с таким значением
+        if field not in INDEX_ATTRS:
+            raise ValueError(f"Индекс для поля {field} не существует.")
+        with db.lock.read():
+            return bool(getattr(db, INDEX_ATTRS[field]).get(value))
+
+    @contextmanager
+    def batch(self, sync: bool = False): # групповая фиксация во всех шардах
+        with ExitStack() as stack:
+            for db in self.shards:
+                stack.enter_context(db.batch(sync))
+            self._local.depth = getattr(self._local, "depth", 0) + 1
+            try:
+                yield self
+            finally:
+                self._local.depth -= 1
+
+    def save_indices(self):
+        self._each("save_indices")
+
+    def checkpoint(self):
+        self._each("checkpoint")
+
+    def compact(self):
+        for db in self.shards:  # по одному: сжатие шарда само использует процессы
+            db.compact()
+
+    def rebuild_indices(self):
+        for db in self.shards:
+            db.rebuild_indices()
+
+    def close(self):
+        self._each("close")
+        self._pool.shutdown()
@@ -0,0 +1,167 @@
+import json
+import os
+import struct
+import zlib
+from array import array
+from itertools import accumulate
+
+from indexes import Bitmap, OrderedIndex, Postings
+
+MAGIC = b"MYSNAP"
+VERSION = 1
+HEAD = struct.Struct("<6sHI")  # сигнатура, версия, длина заголовка JSON
+
+
+def _pack_keys(keys) -> bytes: # ключи одной строкой через "\0" (в ключах его не бывает)
+    raw = "\0".join(keys).encode()
+    return struct.pack("<II", len(keys), len(raw)) + raw
+
+
+def _unpack_keys(data, pos: int = 0):
+    count, size = struct.unpack_from("<II", data, pos)
+    pos += 8
+    keys = data[pos:pos + size].decode().split("\0") if count else []
+    return keys, pos + size
+
+
+def _pack_index(index: dict, kind) -> bytes:
+    keys = list(index.ordered() if isinstance(index, OrderedIndex) else index)  # упорядоченные - по порядку
+    if kind is Bitmap:
+        return _pack_keys(keys) + b"".join(index[key].to_bytes() for key in keys)
+    counts = array("I")
+    offsets = array("q")
+    for key in keys:
+        values = list(index[key])
+        counts.append(len(values))
+        offsets.extend(values)
+    return _pack_keys(keys) + counts.tobytes() + offsets.tobytes()
+
+
+def _unpack_index(data, kind) -> dict:
+    keys, pos = _unpack_keys(data)
+    if kind is Bitmap:
+        index = {}
+        for key in keys:
+            index[key], pos = Bitmap.from_bytes(data, pos)
+        return index
+    counts = array("I")
+    counts.frombytes(data[pos:pos + len(keys) * 4])
+    pos += len(keys) * 4
+    offsets = array("q")
+    offsets.frombytes(data[pos:])  # все адреса одним чтением, без разбора текста
+    if kind is not Postings:
+        offsets = offsets.tolist()
+    # границы списков каждого ключа; срезы и словарь строятся без цикла на Python
+    bounds = list(accumulate(counts, initial=0))
+    values = map(offsets.__getitem__, map(slice, bounds, bounds[1:]))
+    if kind is Postings:
+        values = map(Postings.from_sorted, values)
+    return dict(zip(keys, values))
+
+
+def _pack_sets(sets: dict) -> bytes: # ключ -> множество строк (n-граммы имён)
+    keys = list(sets)
+    counts = array("I", (len(sets[key]) for key in keys))
+    return _pack_keys(keys) + counts.tobytes() + _pack_keys([value for key in keys for value in sets[key]])
+
+
+def _unpack_sets(data) -> dict:
+    keys, pos = _unpack_keys(data)
+    counts = array("I")
+    counts.frombytes(data[pos:pos + len(keys) * 4])
+    values, _ = _unpack_keys(data, pos + len(keys) * 4)
+    bounds = list(accumulate(counts, initial=0))
+    return dict(zip(keys, map(set, map(values.__getitem__, map(slice, bounds, bounds[1:])))))
+
+
+def _stat(path: str):
+    info = os.stat(path)
+    return [info.st_size, info.st_mtime_ns]
+
+
+def save_snapshot(path: str, generation: int, indices: dict, kinds: dict, removed, sources, sets: dict = None) -> None:
+    # indices: поле -> хэш-таблица, kinds: поле -> тип списка адресов,
+    # sources: файлы CSV-снимка, при изменении которых двоичный снимок устаревает,
+    # sets: необязательные разделы "имя -> {ключ: множество строк}" (n-граммы)
+    sections = {}
+    payload = []
+    pos = 0
+    packed = [(field, _pack_index(index, kinds[field])) for field, index in indices.items()]
+    packed += [(name, _pack_sets(value)) for name, value in (sets or {}).items()]
+    for name, data in packed:
+        sections[name] = [pos, len(data), zlib.crc32(data)]
+        payload.append(data)
+        pos += len(data)
+    data = array("q", removed).tobytes()
+    sections["Removed"] = [pos, len(data), zlib.crc32(data)]
+    payload.append(data)
+
+    header = json.dumps({
+        "generation": generation,
+        "sources": [_stat(source) for source in sources],
+        "sections": sections,
+    }).encode()
+    with open(path, "wb") as file:
+        file.write(HEAD.pack(MAGIC, VERSION, len(header)) + header)
+        for data in payload:
+            file.write(data)
+
+
+class Snapshot: # открытый двоичный снимок, разделы читаются по требованию
+    def __init__(self, path: str, generation: int, sources):
+        self.path = path
+        self.header = None
+        self.base = 0
+        if not os.path.exists(path):
+            return
+        with open(path, "rb") as file:
+            head = file.read(HEAD.size)
+            if len(head) < HEAD.size:
+                return
+            magic, version, size = HEAD.unpack(head)
+            if magic != MAGIC or version != VERSION:
+                return
+            try:
+                header = json.loads(file.read(size))
+            except ValueError:
+                return
+        self.base = HEAD.size + size
+        # снимок устарел, если после него была другая контрольная точка или правились CSV-файлы
+        if header["generation"] != generation:
+            return
+        if not all(os.path.exists(source) for source in sources):
+            return
+        if header["sources"] != [_stat(source) for source in sources]:
+            return
+        self.header = header
+
+    def valid(self) -> bool:
+        return self.header is not None
+
+    def _section(self, name: str):
+        pos, length, crc = self.header["sections"][name]
+        with open(self.path, "rb") as file:
+            file.seek(self.base + pos)
+            data = file.read(length)
+        if len(data) != length or zlib.crc32(data) != crc:
+            self.header = None  # повреждён - дальше только CSV
+            return None
+        return data
+
+    def load_index(self, field: str, kind):
+        data = self._section(field)
+        return None if data is None else _unpack_index(data, kind)
+
+    def load_sets(self, name: str): # None - раздела нет или он повреждён
+        if name not in self.header["sections"]:
+            return None
+        data = self._section(name)
+        return None if data is None else _unpack_sets(data)
+
+    def load_removed(self):
+        data = self._section("Removed")
+        if data is None:
+            return None
+        removed = array("q")
+        removed.frombytes(data)
+        return removed.tolist()
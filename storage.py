@@ -0,0 +1,525 @@
+import mmap
+import os
+import struct
+import threading
+from collections import OrderedDict
+
+from metrics import Metrics
+
+FIELDS = ["SN", "Name", "Date", "Compliance Index", "Sold"]
+WIDTHS = [6, 6, 10, 4, 1]  # ширина каждого поля записи
+REMOVED_SN = "------"  # метка удалённой записи в поле SN
+REMOVED = REMOVED_SN.encode()
+ENTRY_BYTES = 480  # примерный размер записи в кэше без учёта строк (кортеж, строки, узел словаря)
+
+
+class RecordCache:  # кэш прочитанных записей (адрес -> поля), вытеснение давно не читанных (LRU)
+    # дозапись в конец файла кэш не трогает: за концом файла записей в кэше нет,
+    # а reset/rewrite/close, после которых адреса переиспользуются, сбрасывают его целиком
+    def __init__(self, budget: int):
+        self.budget = budget  # предел памяти в байтах
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()  # читают параллельно несколько потоков
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _cost(self, fields) -> int:
+        return ENTRY_BYTES + sum(map(len, fields))
+
+    def get(self, offset: int):
+        with self._lock:
+            fields = self._entries.get(offset)
+            if fields is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(offset)
+            self.hits += 1
+            return list(fields)
+
+    def put(self, offset: int, fields):
+        cost = self._cost(fields)
+        with self._lock:
+            self._discard(offset)
+            if cost > self.budget:
+                return
+            self._entries[offset] = tuple(fields)
+            self.size += cost
+            while self.size > self.budget:
+                _, old = self._entries.popitem(last=False)
+                self.size -= self._cost(old)
+
+    def discard(self, offset: int):
+        with self._lock:
+            self._discard(offset)
+
+    def _discard(self, offset: int):
+        fields = self._entries.pop(offset, None)
+        if fields is not None:
+            self.size -= self._cost(fields)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+    def hit_ratio(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+
+class CsvStorage:  # текстовый формат, адрес записи = смещение строки в байтах
+    kind = "csv"
+
+    def __init__(self, file_path: str):
+        self.file_path = file_path
+        self.metrics = Metrics()  # mydb подставляет свои счётчики
+        self.cache = None  # RecordCache, если mydb его включил
+        self.changed = None  # множество адресов, изменённых на месте (заводит фоновое сжатие mydb)
+        if not os.path.exists(file_path):
+            self.reset()
+
+    def _encode(self, fields) -> bytes:
+        return (",".join(fields) + "\r\n").encode()
+
+    def _decode(self, raw: bytes):
+        return raw.decode().strip().split(",")
+
+    def _cached(self, offset: int):
+        if self.cache is None:
+            return None
+        fields = self.cache.get(offset)
+        self.metrics.count("cache_hits" if fields is not None else "cache_misses")
+        return fields
+
+    def _remember(self, offset: int, fields):
+        if self.cache is not None:
+            self.cache.put(offset, fields)
+
+    def _forget(self, offset: int = None):  # без адреса - сброс всего кэша
+        if self.cache is None:
+            return
+        if offset is None:
+            self.cache.clear()
+        else:
+            self.cache.discard(offset)
+
+    def _touch(self, offset: int):  # запись изменена на месте - фоновое сжатие перенесёт её заново
+        if self.changed is not None:
+            self.changed.add(offset)
+
+    def reset(self):  # пустой файл с одним заголовком
+        self._forget()
+        with open(self.file_path, "wb") as file:
+            file.write(self._encode(FIELDS))
+
+    def read(self, offset: int):
+        fields = self._cached(offset)
+        if fields is not None:
+            return fields
+        with open(self.file_path, "rb") as file:
+            file.seek(offset)
+            raw = file.readline()
+        self.metrics.count("seeks")
+        self.metrics.count("bytes_read", len(raw))
+        if not raw.strip():
+            return None
+        fields = self._decode(raw)
+        self._remember(offset, fields)
+        return fields
+
+    def read_many(self, offsets):  # чтение по списку смещений одним открытием файла
+        with open(self.file_path, "rb") as file:
+            for offset in offsets:
+                fields = self._cached(offset)
+                if fields is not None:
+                    yield offset, fields
+                    continue
+                file.seek(offset)
+                raw = file.readline()
+                self.metrics.count("seeks")
+                self.metrics.count("bytes_read", len(raw))
+                if raw.strip():
+                    fields = self._decode(raw)
+                    self._remember(offset, fields)
+                    yield offset, fields
+
+    def check(self, fields):  # ошибка до записи, если поля не запишутся; в текстовом формате годится любое значение
+        pass
+
+    def fits(self, offset: int, fields) -> bool:  # влезет ли новая строка на место старой
+        with open(self.file_path, "rb") as file:
+            file.seek(offset)
+            raw = file.readline()
+        self.metrics.count("seeks")
+        self.metrics.count("bytes_read", len(raw))
+        return len(raw) == len(self._encode(fields))
+
+    def write(self, offset: int, fields):
+        if not self.fits(offset, fields):
+            raise ValueError(f"Строка по смещению {offset} имеет другую длину.")
+        data = self._encode(fields)
+        with open(self.file_path, "r+b") as file:
+            file.seek(offset)
+            file.write(data)
+        self._touch(offset)
+        self.metrics.count("seeks")
+        self.metrics.count("bytes_written", len(data))
+        self._remember(offset, fields)
+
+    def append(self, fields) -> int:
+        with open(self.file_path, "ab") as file:
+            file.seek(0, os.SEEK_END)
+            offset = file.tell()
+            data = self._encode(fields)
+            file.write(data)
+        self.metrics.count("bytes_written", len(data))
+        return offset
+
+    def write_many(self, items) -> list:  # [(смещение, поля)] -> записана ли каждая строка
+        placed = []
+        with open(self.file_path, "r+b") as file:
+            for offset, fields in items:
+                data = self._encode(fields)
+                file.seek(offset)
+                fits = len(file.readline()) == len(data)
+                self.metrics.count("seeks")
+                if fits:
+                    file.seek(offset)
+                    file.write(data)
+                    self._touch(offset)
+                    self.metrics.count("bytes_written", len(data))
+                    self._remember(offset, fields)
+                placed.append(fits)
+        return placed
+
+    def append_many(self, rows) -> list:  # одна буферизованная дозапись, возвращает смещения
+        offsets = []
+        chunks = []
+        with open(self.file_path, "ab") as file:
+            offset = file.seek(0, os.SEEK_END)
+            for fields in rows:
+                data = self._encode(fields)
+                offsets.append(offset)
+                chunks.append(data)
+                offset += len(data)
+            data = b"".join(chunks)
+            file.write(data)
+        self.metrics.count("bytes_written", len(data))
+        return offsets
+
+    def erase(self, offset: int):  # SN заменяется на "------", длина строки не меняется
+        with open(self.file_path, "r+b") as file:
+            file.seek(offset)
+            file.write(REMOVED)
+        self._touch(offset)
+        self.metrics.count("seeks")
+        self.metrics.count("bytes_written", len(REMOVED_SN))
+        self._forget(offset)
+
+    def raw_records(self, start: int = 0, stop: int = None, chunk_size: int = 1 << 16):
+        # строки записей как есть (вместе с удалёнными) в порядке файла, start - смещение начала строки
+        with open(self.file_path, "rb", buffering=chunk_size) as file:
+            offset = file.seek(start)
+            try:
+                for raw in file:
+                    if stop is not None and offset >= stop:
+                        break
+                    if raw.strip() and not raw.startswith(b"SN,"):
+                        yield offset, raw
+                    offset += len(raw)
+            finally:
+                self.metrics.count("bytes_read", offset - start)  # один раз за весь проход
+
+    def records(self, start: int = 0, stop: int = None, chunk_size: int = 1 << 16, skip_removed: bool = False):
+        # skip_removed - удалённые записи отбрасываются по сырым байтам, без разбора полей
+        for offset, raw in self.raw_records(start, stop, chunk_size):
+            if skip_removed and raw.startswith(REMOVED):
+                continue
+            yield offset, self._decode(raw)
+
+    def end(self) -> int:  # адрес за последней записью (граница прохода, ход выгрузки)
+        return os.path.getsize(self.file_path)
+
+    def ranges(self, parts: int) -> list:  # [(start, stop)] - части файла по границам строк
+        size = os.path.getsize(self.file_path)
+        bounds = [0]
+        with open(self.file_path, "rb") as file:
+            for i in range(1, parts):
+                file.seek(max(size * i // parts - 1, bounds[-1]))
+                file.readline()  # до конца строки, на которую попал разрез
+                if bounds[-1] < file.tell() < size:
+                    bounds.append(file.tell())
+        bounds.append(size)
+        return list(zip(bounds, bounds[1:]))
+
+    def _scratch(self, suffix: str = ".tmp"):  # пустой файл того же формата рядом с текущим
+        tmp_path = self.file_path + suffix
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        return type(self)(tmp_path)
+
+    def _swap(self, target):  # готовый файл подменяет текущий
+        target.close()
+        self.close()
+        os.replace(target.file_path, self.file_path)  # адреса всех записей поменялись
+
+    def rewrite(self, rows, batch_size: int = 10000):  # новое содержимое пишется рядом и подменяет файл
+        target = self._scratch()
+        batch = []
+        for fields in rows:
+            batch.append(fields)
+            if len(batch) >= batch_size:
+                target.append_many(batch)
+                batch = []
+        target.append_many(batch)
+        self._swap(target)
+
+    def rewrite_raw(self, chunks):  # то же из готовых байтов записей (их собирают процессы прохода)
+        target = self._scratch()
+        target.close()
+        written = 0
+        with open(target.file_path, "ab") as file:
+            for chunk in chunks:
+                file.write(chunk)
+                written += len(chunk)
+        self.metrics.count("bytes_written", written)
+        self._swap(target)
+
+    def flush(self):
+        pass
+
+    def close(self):  # кэш сбрасывается: пока файл закрыт, его могут подменить (резервная копия)
+        self._forget()
+
+
+class BinStorage:  # двоичный формат фиксированной ширины, адрес записи = номер слота
+    kind = "bin"
+
+    MAGIC = b"MYDB"
+    VERSION = 1
+    HEADER = struct.Struct("<4sHH24x")  # сигнатура, версия, размер слота -> 32 байта
+    RECORD_SIZE = sum(WIDTHS)
+
+    def __init__(self, file_path: str):
+        self.file_path = file_path
+        self.metrics = Metrics()
+        self.cache = None
+        self.changed = None
+        self._file = None
+        self._mm = None
+        self._lock = threading.Lock()
+        if not os.path.exists(file_path):
+            self.reset()
+        self._open()
+
+    def _open(self):
+        if self._file is not None:
+            return
+        self._file = open(self.file_path, "r+b")
+        magic, version, size = self.HEADER.unpack(self._file.read(self.HEADER.size))
+        if magic != self.MAGIC or version != self.VERSION or size != self.RECORD_SIZE:
+            self._file.close()
+            self._file = None
+            raise ValueError(f"Файл {self.file_path} не является двоичной базой mydb.")
+
+    def _map(self):  # отображение файла в память, пересоздаётся после дозаписи
+        mm = self._mm
+        if mm is not None:
+            return mm
+        with self._lock:  # два читателя не должны открыть файл и отобразить его дважды
+            self._open()
+            if self._mm is None:
+                self._mm = mmap.mmap(self._file.fileno(), 0)
+            return self._mm
+
+    def _unmap(self):
+        if self._mm is not None:
+            self._mm.close()
+            self._mm = None
+
+    def _encode(self, fields) -> bytes:
+        data = b""
+        for value, width in zip(fields, WIDTHS):
+            raw = value.encode()
+            if len(raw) > width:
+                raise ValueError(f"Значение {value!r} длиннее {width} символов.")
+            data += raw.ljust(width)
+        return data
+
+    def _decode(self, raw: bytes):
+        fields = []
+        pos = 0
+        for width in WIDTHS:
+            fields.append(raw[pos:pos + width].decode().rstrip())
+            pos += width
+        return fields
+
+    def _pos(self, slot: int) -> int:
+        return self.HEADER.size + slot * self.RECORD_SIZE
+
+    def count(self) -> int:  # число слотов в файле
+        return (len(self._map()) - self.HEADER.size) // self.RECORD_SIZE
+
+    _cached = CsvStorage._cached
+    _remember = CsvStorage._remember
+    _forget = CsvStorage._forget
+    _touch = CsvStorage._touch
+
+    def reset(self):
+        self.close()
+        with open(self.file_path, "wb") as file:
+            file.write(self.HEADER.pack(self.MAGIC, self.VERSION, self.RECORD_SIZE))
+
+    def read(self, slot: int):
+        fields = self._cached(slot)
+        if fields is not None:
+            return fields
+        if slot < 0 or slot >= self.count():
+            return None
+        pos = self._pos(slot)
+        self.metrics.count("seeks")
+        self.metrics.count("bytes_read", self.RECORD_SIZE)
+        fields = self._decode(self._mm[pos:pos + self.RECORD_SIZE])
+        self._remember(slot, fields)
+        return fields
+
+    def read_many(self, slots):
+        for slot in slots:
+            fields = self.read(slot)
+            if fields is not None:
+                yield slot, fields
+
+    def check(self, fields):  # ошибка до записи, если значение не влезает в слот
+        self._encode(fields)
+
+    def fits(self, slot: int, fields) -> bool:
+        return True
+
+    def write(self, slot: int, fields):
+        data = self._encode(fields)
+        if slot < 0 or slot >= self.count():
+            raise ValueError(f"Слот {slot} не существует.")
+        pos = self._pos(slot)
+        self._mm[pos:pos + self.RECORD_SIZE] = data
+        self._touch(slot)
+        self.metrics.count("seeks")
+        self.metrics.count("bytes_written", len(data))
+        self._remember(slot, fields)
+
+    def append(self, fields) -> int:
+        data = self._encode(fields)
+        self._open()
+        self._unmap()
+        self._file.seek(0, os.SEEK_END)
+        slot = (self._file.tell() - self.HEADER.size) // self.RECORD_SIZE
+        self._file.write(data)
+        self._file.flush()
+        self.metrics.count("bytes_written", len(data))
+        return slot
+
+    def write_many(self, items) -> list:
+        for slot, fields in items:
+            self.write(slot, fields)
+        return [True] * len(items)
+
+    def append_many(self, rows) -> list:
+        data = b"".join(self._encode(fields) for fields in rows)
+        self._open()
+        self._unmap()
+        self._file.seek(0, os.SEEK_END)
+        first = (self._file.tell() - self.HEADER.size) // self.RECORD_SIZE
+        self._file.write(data)
+        self._file.flush()
+        self.metrics.count("bytes_written", len(data))
+        return list(range(first, first + len(data) // self.RECORD_SIZE))
+
+    def erase(self, slot: int):
+        pos = self._pos(slot)
+        if slot < 0 or slot >= self.count():
+            raise ValueError(f"Слот {slot} не существует.")
+        self._mm[pos:pos + len(REMOVED)] = REMOVED
+        self._touch(slot)
+        self.metrics.count("seeks")
+        self.metrics.count("bytes_written", len(REMOVED_SN))
+        self._forget(slot)
+
+    def raw_records(self, start: int = 0, stop: int = None, chunk_size: int = 1 << 16):
+        # своё открытие файла, а не общее отображение: то закрывается при каждой дозаписи
+        # и при подмене файла, а проход (выгрузка) может идти без блокировки
+        per_chunk = max(1, chunk_size // self.RECORD_SIZE)  # слотов за одно чтение
+        with open(self.file_path, "rb") as file:
+            count = (os.fstat(file.fileno()).st_size - self.HEADER.size) // self.RECORD_SIZE
+            count = count if stop is None else min(stop, count)
+            file.seek(self._pos(start))
+            for first in range(start, count, per_chunk):
+                last = min(first + per_chunk, count)
+                chunk = file.read(self._pos(last) - self._pos(first))
+                self.metrics.count("bytes_read", len(chunk))
+                for i in range(last - first):
+                    yield first + i, chunk[i * self.RECORD_SIZE:(i + 1) * self.RECORD_SIZE]
+
+    records = CsvStorage.records
+
+    def end(self) -> int:
+        return self.count()
+
+    def ranges(self, parts: int) -> list:  # [(start, stop)] - части файла поровну по слотам
+        count = self.count()
+        bounds = sorted({count * i // parts for i in range(parts + 1)})
+        return list(zip(bounds, bounds[1:]))
+
+    _scratch = CsvStorage._scratch
+    _swap = CsvStorage._swap
+    rewrite = CsvStorage.rewrite
+    rewrite_raw = CsvStorage.rewrite_raw
+
+    def flush(self):
+        if self._mm is not None:
+            self._mm.flush()
+        if self._file is not None:
+            self._file.flush()
+
+    def close(self):  # после закрытия файл переоткрывается при следующем обращении
+        self._forget()
+        self._unmap()
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+STORAGES = {"csv": CsvStorage, "bin": BinStorage}
+
+
+def detect_kind(file_path: str) -> str:  # формат существующего файла или по расширению нового
+    if os.path.exists(file_path):
+        with open(file_path, "rb") as file:
+            if file.read(len(BinStorage.MAGIC)) == BinStorage.MAGIC:
+                return "bin"
+        return "csv"
+    if file_path.endswith(".mydb"):
+        return "bin"
+    return "csv"
+
+
+def open_storage(file_path: str, kind: str = None):
+    if kind is None:
+        kind = detect_kind(file_path)
+    if kind not in STORAGES:
+        raise ValueError(f"Неизвестный формат хранения: {kind}")
+    return STORAGES[kind](file_path)
+
+
+def convert(source, dst_path: str, kind: str):  # копирует записи в новый формат
+    if os.path.exists(dst_path):
+        os.remove(dst_path)
+    target = open_storage(dst_path, kind)
+    mapping = {}  # старый адрес -> новый адрес
+    # удалённые записи тоже переносятся, чтобы список removed остался верным
+    for address, fields in source.records():
+        mapping[address] = target.append(fields)
+    target.flush()
+    return target, mapping